@@ -6,14 +6,114 @@
 import argparse 
 import urllib2
 import re
+import sys
+import time
+import hashlib
+import sqlite3
+import httplib
+import socket
+import threading
+import Queue
+import urlparse
+import BaseHTTPServer
+import SocketServer
+import os
+import errno
+import types
+import ast
+from StringIO import StringIO
+from xml.parsers import expat
+
+unacceptable_chars_re = re.compile(r"[^\d\s+-/=()%.*><,]")
 
 def is_arithmetic(target):
 	"""
 	Check if target string contains only numbers, whitespace, and the
 	arithmetic/comparison operators +-/=()%.*><, 
 	"""
-	unacceptable_chars = r"[^\d\s+-/=()%.*><,]"
-	return (re.search(unacceptable_chars, target) is None)
+	return (unacceptable_chars_re.search(target) is None)
+
+def has_nested_code(code):
+	"""
+	Check if the code object defines any functions, such as lambdas or 
+	generator expressions, whose names are in their own code objects
+	"""
+	return any(isinstance(const, types.CodeType) for const in code.co_consts)
+
+def has_attribute_access(target):
+	"""
+	Check if the target expression gets any attributes or items or calls
+	anything.  Attribute names are in co_names too, so a variable name 
+	would otherwise also be allowed as an attribute name.
+	"""
+	return any(isinstance(node, (ast.Attribute, ast.Call, ast.Subscript))
+			   for node in ast.walk(ast.parse(target.strip(), mode="eval")))
+
+# compiled code objects of previously seen targets, keyed on the target 
+# string. Targets that cannot be evaluated locally are stored as None.
+compiled_cache = {}
+compiled_cache_size = 10**5
+
+def compile_arithmetic(target):
+	"""
+	Compile the target string as a python expression and return the
+	corresponding code object. None is returned if the target is not 
+	arithmetic, is not valid syntax, or if the compiled expression looks
+	up any names (builtins, attributes, etc.) or defines any functions, 
+	so that only numbers and arithmetic/comparison operators are ever 
+	evaluated.  Results are 
+	cached, so each distinct target string is only compiled once.
+	"""
+	if target in compiled_cache:
+		return compiled_cache[target]
+	code = None
+	if is_arithmetic(target):
+		try:
+			code = compile(target.strip(), "<CalCalc>", "eval")
+		except SyntaxError:
+			code = None
+		if code is not None and (code.co_names or has_nested_code(code)):
+			code = None
+	if len(compiled_cache) >= compiled_cache_size:
+		compiled_cache.clear()
+	compiled_cache[target] = code
+	return code
+
+identifier_re = re.compile(r"\b[A-Za-z_]\w*\b")
+
+def compile_parametric(target, variables):
+	"""
+	Compile the target string as an arithmetic expression in the named 
+	variables and return the corresponding code object.  With the 
+	variable names removed, target must pass is_arithmetic, and the 
+	compiled expression may not look up any name other than the variables,
+	get attributes or items, call anything, or define any functions.  
+	Raises a ValueError otherwise.  Results are cached as in 
+	compile_arithmetic.
+	"""
+	variables = frozenset(variables)
+	key = (target, variables)
+	if key in compiled_cache:
+		return compiled_cache[key]
+	for name in variables:
+		if identifier_re.match(name) is None or name.startswith("_"):
+			raise ValueError("Invalid variable name: {}".format(name))
+	if not is_arithmetic(identifier_re.sub(" ", target)):
+		raise ValueError("Not an arithmetic expression: {}".format(target))
+	try:
+		code = compile(target.strip(), "<CalCalc>", "eval")
+	except SyntaxError:
+		raise ValueError("Invalid expression: {}".format(target))
+	if has_nested_code(code) or has_attribute_access(target):
+		raise ValueError("Not an arithmetic expression: {}".format(target))
+	unknown = set(code.co_names) - variables
+	if unknown:
+		raise ValueError("Unknown variables in {}: {}".format(target, 
+						 ", ".join(sorted(unknown))))
+	if len(compiled_cache) >= compiled_cache_size:
+		compiled_cache.clear()
+	compiled_cache[key] = code
+	return code
 
 class ReadURL(object):
 	"""
@@ -30,56 +130,513 @@ class ReadURL(object):
 	def __exit__(self, type, value, traceback):
 		self.stream.close()
 
-def query_wolframalpha(request):
+class WolframCache(object):
+	"""
+	A persistent cache of wolfram alpha results, stored in an sqlite 
+	database file.  Entries are keyed on a hash of the normalized request
+	string, so requests differing only in whitespace share an entry.  
+	Entries older than ttl seconds are treated as missing, and once the 
+	cache holds more than max_size entries the least recently used ones 
+	are evicted.  Counts of cache hits and misses are kept in the hits 
+	and misses attributes.  A cache may be shared between threads.
+	"""
+	def __init__(self, filename, ttl=30*24*3600.0, max_size=10**4):
+		self.filename = filename
+		self.ttl = ttl
+		self.max_size = max_size
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+		self.db = sqlite3.connect(filename, check_same_thread=False)
+		# wolfram results are utf-8 encoded byte strings
+		self.db.text_factory = str
+		self.db.execute("CREATE TABLE IF NOT EXISTS results "
+						"(key TEXT PRIMARY KEY, result TEXT, "
+						"created REAL, accessed REAL)")
+		self.db.execute("CREATE INDEX IF NOT EXISTS results_accessed "
+						"ON results (accessed)")
+		self.db.commit()
+
+	@staticmethod
+	def make_key(request):
+		normalized = " ".join(str(request).split())
+		return hashlib.sha1(normalized).hexdigest()
+
+	def lookup(self, request):
+		"""
+		Return a tuple (found, result), where found is True if a current
+		entry for request is in the cache and result is the cached result.
+		"""
+		key = self.make_key(request)
+		now = time.time()
+		with self.lock:
+			row = self.db.execute("SELECT result, created FROM results "
+								  "WHERE key = ?", (key,)).fetchone()
+			if row is None or now - row[1] > self.ttl:
+				self.misses += 1
+				return False, None
+			self.db.execute("UPDATE results SET accessed = ? WHERE key = ?", 
+							(now, key))
+			self.db.commit()
+			self.hits += 1
+		return True, row[0]
+
+	def store(self, request, result):
+		""" Save result as the cached result of request """
+		now = time.time()
+		with self.lock:
+			self.db.execute("INSERT OR REPLACE INTO results "
+							"VALUES (?, ?, ?, ?)",
+							(self.make_key(request), result, now, now))
+			self.db.execute("DELETE FROM results WHERE created < ?", 
+							(now - self.ttl,))
+			self.db.execute("DELETE FROM results WHERE key IN (SELECT key "
+							"FROM results ORDER BY accessed DESC, rowid DESC "
+							"LIMIT -1 OFFSET ?)", (self.max_size,))
+			self.db.commit()
+
+	def __len__(self):
+		with self.lock:
+			return self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+	def stats(self):
+		return {"hits":self.hits, "misses":self.misses, "size":len(self)}
+
+	def close(self):
+		self.db.close()
+
+# the string TKA4Y6-23XL8P9RRP is my own wolfram app id, it is restricted
+# to 2000 calls per month, after which each call will fail
+wolfram_host = "api.wolframalpha.com"
+wolfram_appid = "TKA4Y6-23XL8P9RRP"
+
+def wolfram_query_path(request):
+	"""
+	Return the path and query string of the wolfram api url for request
+	"""
+	# strip leading and trailing whitespace, replace all other whitespace
+	# with the characters %20, as is the convention in wolfram urls
+	wolfram_request = re.sub(r"\s", "%20", str(request).strip())
+	# this is the conventional form for a wolfram search url
+	return "/v2/query?input={}&appid={}".format(wolfram_request, wolfram_appid)
+
+class ResultFound(Exception):
+	""" Raised inside ResultPodParser to stop parsing at the result """
+	pass
+
+class ResultPodParser(object):
+	"""
+	Incremental parser for wolfram xml.  Pieces of the response are 
+	passed to feed as they arrive, and parsing stops as soon as the first 
+	non-empty plain text under a "Result" pod is complete.  The result is 
+	then available in the result attribute as a utf-8 encoded string.
+	"""
+	def __init__(self):
+		self.result = None
+		self.done = False
+		self.in_result_pod = False
+		self.text = None
+		self.parser = expat.ParserCreate()
+		self.parser.StartElementHandler = self.start_element
+		self.parser.EndElementHandler = self.end_element
+		self.parser.CharacterDataHandler = self.character_data
+
+	def start_element(self, name, attrs):
+		if name == "pod":
+			self.in_result_pod = (attrs.get("title") == "Result")
+		elif name == "plaintext" and self.in_result_pod:
+			self.text = []
+
+	def end_element(self, name):
+		if name == "pod":
+			self.in_result_pod = False
+		elif name == "plaintext" and self.text is not None:
+			result = "".join(self.text).encode("utf-8")
+			self.text = None
+			if result:
+				self.result = result
+				raise ResultFound
+
+	def character_data(self, data):
+		if self.text is not None:
+			self.text.append(data)
+
+	def feed(self, data):
+		""" Parse the string data, returning True once a result is found """
+		if not self.done:
+			try:
+				self.parser.Parse(data, False)
+			except ResultFound:
+				self.done = True
+		return self.done
+
+def parse_wolfram_stream(stream, chunk_size=8192):
+	"""
+	Read the wolfram xml response from the file-like stream chunk_size 
+	bytes at a time and return the first string of plain text under a 
+	"Result" pod, or None if there is none.  Reading stops as soon as 
+	the result is found, so the rest of the response is never read. 
+	"""
+	parser = ResultPodParser()
+	try:
+		while True:
+			data = stream.read(chunk_size)
+			if not data or parser.feed(data):
+				break
+	except expat.ExpatError:
+		pass
+	return parser.result
+
+def parse_wolfram_results(full_results):
+	"""
+	Return the first string of plain text under a "Result" pod in the 
+	xml string full_results returned by wolfram, or None if there is none.
+	"""
+	return parse_wolfram_stream(StringIO(full_results))
+
+def query_wolframalpha(request, cache=None):
 	"""
 	Send the string request to wolfram alpha, and return the first 
 	string 	that wolfram displays under the "Results" heading. If 
-	no plain text result is received from wolfram, returns None. 
+	no plain text result is received from wolfram, returns None. If a
+	WolframCache is passed as cache, it is checked before contacting 
+	wolfram and any new result is saved to it.
 	"""
 	request = str(request)
-	# strip leading and trailing whitespace, replace all other whitespace
-	# with the characters %20, as is the convention in wolfram urls
-	wolfram_request = re.sub(r"\s", "%20", request.strip())
-	# this is the conventional form for a wolfram search url, the string 
-	# TKA4Y6-23XL8P9RRP my own wolfram app id, it is restricted to 2000 
-	# calls per month, after which each call will fail
-	wolfram_url = ("http://api.wolframalpha.com/v2/query?input="
-				   "{}&appid=TKA4Y6-23XL8P9RRP".format(wolfram_request))
-	# get wolfram results, extract all 'results pod' matches.  The 
-	# formating for these comes from examining a few wolfram search results.
-	results_pod_re = re.compile(r"<pod title='Result'.*?</pod>", re.DOTALL)
+	if cache is not None:
+		found, result = cache.lookup(request)
+		if found:
+			return result
+		result = query_wolframalpha(request)
+		cache.store(request, result)
+		return result
+	wolfram_url = "http://{}{}".format(wolfram_host, 
+									   wolfram_query_path(request))
+	# the stream is closed as soon as the result is found
 	with ReadURL(wolfram_url) as wolfram_search:
-		full_results = wolfram_search.read()
-		results_pods = results_pod_re.finditer(full_results)
-	# return the first chunk of plain text in a 'results pod' 
-	plaintext_re = re.compile(r"<plaintext>(.*?)</plaintext>", re.DOTALL)
-	for pod_match in results_pods:
-		pod_string = pod_match.group() 
-		result = plaintext_re.search(pod_string)
-		if result is not None:
-			return result.group(1)
-	# no results pods contain a plain text answer
-	return None
-
-def calculate(target, force_wolfram=False):
+		return parse_wolfram_stream(wolfram_search)
+
+class TokenBucket(object):
+	"""
+	Thread-safe token bucket rate limiter.  Tokens are added at rate per 
+	second, up to a maximum of capacity, and each call to acquire blocks 
+	until it can remove one token. 
+	"""
+	def __init__(self, rate, capacity=1):
+		self.rate = float(rate)
+		self.capacity = float(capacity)
+		self.tokens = float(capacity)
+		self.last = time.time()
+		self.lock = threading.Lock()
+
+	def acquire(self):
+		while True:
+			with self.lock:
+				now = time.time()
+				self.tokens = min(self.capacity, 
+								  self.tokens + (now - self.last)*self.rate)
+				self.last = now
+				if self.tokens >= 1.0:
+					self.tokens -= 1.0
+					return
+				wait = (1.0 - self.tokens)/self.rate
+			time.sleep(wait)
+
+class WolframPool(object):
+	"""
+	Send many requests to wolfram alpha concurrently.  A fixed number of 
+	worker threads each hold one persistent keep-alive connection to the
+	wolfram host, so at most workers requests are in flight at once, and 
+	all requests are throttled by a token bucket allowing rate requests 
+	per second with bursts of up to burst requests.  To stay within the 
+	app id quota of 2000 calls per month, use rate=2000/(30*24*3600.0).
+	The workers are started by the first query_many and kept, with their
+	connections, for all later calls until close.
+	"""
+	def __init__(self, workers=4, rate=5.0, burst=1, host=None, 
+				 port=80, timeout=30.0, drain_limit=2**16):
+		self.workers = int(workers)
+		self.limiter = TokenBucket(rate, burst)
+		self.host = wolfram_host if host is None else host
+		self.port = port
+		self.timeout = timeout
+		self.drain_limit = drain_limit
+		self.tasks = Queue.Queue()
+		self.threads = []
+		self.lock = threading.Lock()
+
+	def fetch(self, connection, request):
+		"""
+		Query wolfram for request over the open connection, reconnecting 
+		once if the server has closed it before sending any response, 
+		after taking another token from the limiter.  A response that 
+		arrives is never retried.  Returns the parsed result.  If
+		more than drain_limit bytes of the response remain unread after 
+		the result is found, the connection is dropped rather than reading
+		them, otherwise the rest is read so the connection can be reused.
+		An error status raises httplib.HTTPException.
+		"""
+		path = wolfram_query_path(request)
+		for attempt in [0, 1]:
+			if attempt:
+				self.limiter.acquire()
+			try:
+				connection.request("GET", path)
+				response = connection.getresponse()
+				break
+			except (httplib.BadStatusLine, socket.error):
+				connection.close()
+				if attempt:
+					raise
+		try:
+			if response.status != 200:
+				raise httplib.HTTPException("wolfram returned HTTP status "
+											"{}".format(response.status))
+			result = parse_wolfram_stream(response)
+		except (httplib.HTTPException, socket.error):
+			connection.close()
+			raise
+		if not response.isclosed():
+			if (response.length is not None and 
+				response.length <= self.drain_limit):
+				response.read()
+			else:
+				connection.close()
+		return result
+
+	def worker(self):
+		connection = httplib.HTTPConnection(self.host, self.port, 
+											timeout=self.timeout)
+		try:
+			while True:
+				task = self.tasks.get()
+				if task is None:
+					return
+				index, request, results, finished = task
+				self.limiter.acquire()
+				try:
+					results[index] = self.fetch(connection, request)
+				except (httplib.HTTPException, socket.error) as error:
+					results[index] = error
+				finished.put(index)
+		finally:
+			connection.close()
+
+	def start(self):
+		with self.lock:
+			while len(self.threads) < self.workers:
+				thread = threading.Thread(target=self.worker)
+				thread.daemon = True
+				thread.start()
+				self.threads.append(thread)
+
+	def query_many(self, requests, cache=None):
+		"""
+		Query wolfram for each string in requests and return a list of 
+		the results, in the same order as requests.  Requests found in 
+		the WolframCache cache are not sent, and new results are stored. 
+		A request that fails with a network or HTTP error has the 
+		exception in place of its result, and is not cached.
+		"""
+		requests = [str(request) for request in requests]
+		results = [None]*len(requests)
+		finished = Queue.Queue()
+		to_send = []
+		for index, request in enumerate(requests):
+			if cache is not None:
+				found, result = cache.lookup(request)
+				if found:
+					results[index] = result
+					continue
+			to_send.append(index)
+		if to_send:
+			self.start()
+		for index in to_send:
+			self.tasks.put((index, requests[index], results, finished))
+		for index in to_send:
+			index = finished.get()
+			if cache is not None and not isinstance(results[index], 
+													Exception):
+				cache.store(requests[index], results[index])
+		return results
+
+	def close(self):
+		""" Stop the workers and close their connections """
+		with self.lock:
+			for thread in self.threads:
+				self.tasks.put(None)
+			for thread in self.threads:
+				thread.join()
+			self.threads = []
+
+def evaluate_locally(target):
+	"""
+	Evaluate the target string in python if it is arithmetic. Returns a
+	tuple (success, result), where success is False if the target could 
+	not be evaluated locally.
+	"""
+	code = compile_arithmetic(target)
+	if code is None:
+		return False, None
+	try:
+		return True, eval(code, {"__builtins__": None}, {})
+	except:
+		return False, None
+
+def calculate(target, force_wolfram=False, cache=None):
 	"""
 	Evaluate the target string.  For security, evaluation is only done 
 	locally if the target string contains only numbers and arithmetic 
 	operators.  Otherwise, or if local evaluation fails, the target 
-	string is evaluated with wolfram alpha.
+	string is evaluated with wolfram alpha, using the WolframCache cache 
+	if one is given.
 	"""
-	wolfram = force_wolfram or not is_arithmetic(target)
-	if not wolfram:
-		try:
-			results = eval(target)
-		except:
-			results = query_wolframalpha(target)
+	if force_wolfram:
+		local = False
 	else:
-		results = query_wolframalpha(target)
+		local, results = evaluate_locally(target)
+	if not local:
+		results = query_wolframalpha(target, cache=cache)
 	if results is None:
 		results = "Result could not be found"
 	return results
 
+def calculate_many(targets, force_wolfram=False, cache=None, pool=None,
+				   chunk_size=64):
+	"""
+	Evaluate each string in the iterable targets as in calculate, 
+	yielding the results in the same order as the targets.  This is a
+	generator, so targets can be an open file or any other stream and 
+	results are produced as soon as each target is evaluated.  If a 
+	WolframPool is passed as pool, targets are read chunk_size at a time
+	and all targets in a chunk that need wolfram are queried concurrently.
+	"""
+	if pool is None:
+		for target in targets:
+			yield calculate(target, force_wolfram=force_wolfram, cache=cache)
+		return
+	chunk = []
+	for target in targets:
+		chunk.append(target)
+		if len(chunk) == chunk_size:
+			for results in calculate_chunk(chunk, force_wolfram, cache, pool):
+				yield results
+			chunk = []
+	for results in calculate_chunk(chunk, force_wolfram, cache, pool):
+		yield results
+
+def calculate_chunk(targets, force_wolfram, cache, pool):
+	""" Evaluate the list targets for calculate_many using pool """
+	results = [None]*len(targets)
+	remote = []
+	for index, target in enumerate(targets):
+		if force_wolfram:
+			local = False
+		else:
+			local, results[index] = evaluate_locally(target)
+		if not local:
+			remote.append(index)
+	remote_results = pool.query_many([targets[index] for index in remote], 
+									 cache=cache)
+	for index, result in zip(remote, remote_results):
+		if isinstance(result, Exception):
+			result = "Wolfram request failed: {}".format(result)
+		results[index] = result
+	return ["Result could not be found" if result is None else result 
+			for result in results]
+
+def calculate_vectorized(target, bindings, chunk_size=2**20, out=None):
+	"""
+	Evaluate the arithmetic expression target with numpy, using the dict
+	bindings of variable names to arrays or scalars.  The expression is
+	compiled once, as in compile_parametric, and then evaluated over whole
+	arrays at a time.  Arrays must all have the same length, and are
+	processed in chunks of chunk_size elements so that the temporary 
+	arrays stay small; the bindings and out may be numpy memmaps to 
+	evaluate inputs larger than memory.  Results are written to the array
+	out if given, otherwise a new array is returned.
+	"""
+	import numpy as np
+	code = compile_parametric(target, bindings.keys())
+	namespace = {"__builtins__": None}
+	arrays, scalars = {}, {}
+	for name, value in bindings.items():
+		if np.ndim(value) == 0:
+			scalars[name] = value
+		else:
+			arrays[name] = value
+	if not arrays:
+		return eval(code, namespace, scalars)
+	lengths = set(len(value) for value in arrays.values())
+	if len(lengths) != 1:
+		raise ValueError("All bound arrays must have the same length")
+	length = lengths.pop()
+	for start in xrange(0, length, chunk_size):
+		stop = min(start + chunk_size, length)
+		chunk = dict(scalars)
+		for name, value in arrays.items():
+			chunk[name] = np.asarray(value[start:stop])
+		result = eval(code, namespace, chunk)
+		if out is None:
+			result = np.asarray(result)
+			out = np.empty((length,) + result.shape[1:], dtype=result.dtype)
+		out[start:stop] = result
+	return out
+
+default_socket = "/tmp/calcalc.sock"
+
+class CalCalcHandler(SocketServer.StreamRequestHandler):
+	"""
+	Answer newline-delimited target strings with newline-delimited 
+	results.  Results are escaped with python's string_escape codec, so 
+	that a multi-line wolfram result stays on one line.  A target whose 
+	evaluation raises is answered with "Error: " and the exception, and 
+	the connection stays open.
+	"""
+	def handle(self):
+		for line in iter(self.rfile.readline, ""):
+			target = line.rstrip("\n")
+			try:
+				result = calculate(target, cache=self.server.cache)
+			except Exception as error:
+				result = "Error: {}".format(error)
+			self.wfile.write(str(result).encode("string_escape") + "\n")
+
+class CalCalcServer(SocketServer.ThreadingMixIn, 
+					SocketServer.UnixStreamServer):
+	"""
+	Resident evaluation server listening on the unix socket at path.  As
+	the server lives across queries, compiled arithmetic stays cached in
+	memory and the optional WolframCache cache stays open.  Clients may 
+	keep their connection open for any number of queries.  A stale socket
+	file left at path is replaced, but if another server is listening 
+	there socket.error is raised.
+	"""
+	daemon_threads = True
+
+	def __init__(self, path=default_socket, cache=None):
+		self.path = path
+		self.cache = cache
+		if os.path.exists(path):
+			probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			try:
+				probe.connect(path)
+			except socket.error as error:
+				if error.errno != errno.ECONNREFUSED:
+					raise
+				os.remove(path)
+			else:
+				raise socket.error(errno.EADDRINUSE, "a CalCalc server is "
+								   "already listening on {}".format(path))
+			finally:
+				probe.close()
+		SocketServer.UnixStreamServer.__init__(self, path, CalCalcHandler)
+
+	def server_close(self):
+		SocketServer.UnixStreamServer.server_close(self)
+		if os.path.exists(self.path):
+			os.remove(self.path)
+
 ########################################################################
 
 def test_1(): 
@@ -97,14 +654,245 @@ def test_4():
 def test_5():
 	assert abs(float(calculate("e^(sqrt(-1)*2pi)")) - 1.0) < 10**(-12)
 
+def test_6():
+	targets = ["3 + 7", "2**10", "7 % 4", "1 < 2"]
+	assert list(calculate_many(targets)) == [10, 1024, 3, True]
+
+def test_7():
+	assert compile_arithmetic("3 + 7") is compile_arithmetic("3 + 7")
+	assert compile_arithmetic("__import__('os')") is None
+	assert compile_arithmetic("3 +* 7") is None
+
+def test_8():
+	cache = WolframCache(":memory:", max_size=2)
+	cache.store("mass of  the proton", "938.27 MeV")
+	assert cache.lookup(" mass of the proton ") == (True, "938.27 MeV")
+	assert cache.lookup("mass of the electron") == (False, None)
+	assert calculate("mass of the proton", cache=cache) == "938.27 MeV"
+	cache.store("a", "1")
+	cache.store("b", "2")
+	assert len(cache) == 2
+	assert cache.lookup("mass of the proton") == (False, None)
+	assert (cache.hits, cache.misses) == (2, 2)
+
+def test_9():
+	cache = WolframCache(":memory:", ttl=-1.0)
+	cache.store("speed of light", "299792458 m/s")
+	assert cache.lookup("speed of light") == (False, None)
+
+class StubWolframHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	""" 
+	Serves canned wolfram xml whose result is the query input, or a 503 
+	error for the input "error"
+	"""
+	protocol_version = "HTTP/1.1"
+
+	def do_GET(self):
+		query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+		self.server.connections.add(self.client_address)
+		self.server.queries.append(query["input"][0])
+		if query["input"][0] == "error":
+			return self.send_error(503)
+		body = ("<queryresult><pod title='Input' id='Input'><subpod title=''>"
+				"<plaintext>input</plaintext></subpod></pod>"
+				"<pod title='Result' id='Result'><subpod title=''>"
+				"<plaintext>{}</plaintext></subpod></pod>"
+				"</queryresult>".format(query["input"][0]))
+		self.send_response(200)
+		self.send_header("Content-Type", "text/xml")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+class StubWolframServer(SocketServer.ThreadingMixIn, 
+						BaseHTTPServer.HTTPServer):
+	""" Threaded, so that each pooled keep-alive connection is served """
+	daemon_threads = True
+
+def start_stub_server():
+	server = StubWolframServer(("localhost", 0), StubWolframHandler)
+	server.connections = set()
+	server.queries = []
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	return server
+
+def test_10():
+	server = start_stub_server()
+	pool = WolframPool(workers=2, rate=1000.0, burst=10, host="localhost", 
+					   port=server.server_port)
+	requests = ["question {}".format(n) for n in range(10)]
+	assert pool.query_many(requests) == requests
+	assert len(server.connections) <= 2
+	targets = ["1 + 1", "what is two", "3*3", "what is ten"]
+	assert list(calculate_many(targets, pool=pool, chunk_size=2)) == \
+		[2, "what is two", 9, "what is ten"]
+	assert len(server.connections) <= 2
+	cache = WolframCache(":memory:")
+	results = pool.query_many(["error", "fine"], cache=cache)
+	assert isinstance(results[0], httplib.HTTPException)
+	assert results[1] == "fine"
+	assert cache.lookup("error") == (False, None)
+	assert server.queries.count("error") == 1
+	pool.close()
+	server.shutdown()
+
+def test_11():
+	limiter = TokenBucket(100.0, capacity=1)
+	start = time.time()
+	for n in range(11):
+		limiter.acquire()
+	assert time.time() - start >= 0.09
+
+def test_12():
+	xml = ("<queryresult><pod title='Input'><subpod><plaintext>x"
+		   "</plaintext></subpod></pod><pod title='Result'><subpod>"
+		   "<plaintext></plaintext><img src='a.gif'/></subpod><subpod>"
+		   "<plaintext>3 &lt; 4</plaintext></subpod></pod>"
+		   "<pod title='Image'>" + "<img src='b.gif'/>"*1000 + "</pod>"
+		   "</queryresult>")
+	stream = StringIO(xml)
+	assert parse_wolfram_stream(stream, chunk_size=7) == "3 < 4"
+	assert stream.tell() < 200
+	assert parse_wolfram_results(xml.replace("'Result'", "'Other'")) is None
+
+def test_13():
+	import numpy as np
+	x = np.arange(10.0)
+	expected = 3*x**2 + 7
+	assert np.allclose(calculate_vectorized("3*x**2 + 7", {"x":x}), expected)
+	assert np.allclose(calculate_vectorized("a*x**2 + 7", {"x":x, "a":3},
+											chunk_size=3), expected)
+	for target in ["x.real", "__import__('os')", "y + 1", 
+				   "(v.__class__ for v in x)", "x in (v.real for v in x)", 
+				   "(lambda x: x)(x)", "x.fill(7) or x", "x.tofile", "x[0]"]:
+		try:
+			calculate_vectorized(target, {"x":x, "fill":0, "tofile":0})
+			assert False
+		except ValueError:
+			pass
+	assert np.array_equal(x, np.arange(10.0))
+
+def test_14():
+	from calc_client import CalCalcClient
+	path = "/tmp/calcalc_test_{}.sock".format(os.getpid())
+	cache = WolframCache(":memory:")
+	cache.store("two lines", "first\nsecond")
+	server = CalCalcServer(path, cache=cache)
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	client = CalCalcClient(path)
+	assert client.calculate("3 + 7") == "10"
+	assert client.calculate("two lines") == "first\nsecond"
+	assert client.calculate_many(["1 + 1", "2**3"]) == ["2", "8"]
+	try:
+		CalCalcServer(path)
+		assert False
+	except socket.error as error:
+		assert error.errno == errno.EADDRINUSE
+	cache.close()
+	assert client.calculate("mass of the proton").startswith("Error: ")
+	assert client.calculate("3 + 7") == "10"
+	client.close()
+	server.shutdown()
+	server.server_close()
+	assert not os.path.exists(path)
+	stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	stale.bind(path)
+	stale.close()
+	CalCalcServer(path).server_close()
+
 ########################################################################	
 
 if __name__ == '__main__':
 	# process cmd line args
 	parser = argparse.ArgumentParser("Generate a histogram")
-	parser.add_argument("to_evaluate", type=str, help="string to evaluate")
+	parser.add_argument("to_evaluate", type=str, nargs="?", 
+						help="string to evaluate")
 	parser.add_argument("-w", action="store_true", dest="wolfram", default=False, 
 						help="force evaluation using wolfram alpha")
+	parser.add_argument("--batch", type=str, dest="batch", default=None, 
+						metavar="FILE", help="evaluate each line of FILE, "
+						"one result per output line; use - for stdin")
+	parser.add_argument("-t", action="store_true", dest="timing", default=False,
+						help="report batch throughput to stderr")
+	parser.add_argument("-j", type=int, dest="workers", default=None, 
+						help="in batch mode, send up to this many concurrent "
+						"wolfram requests")
+	parser.add_argument("--rate", type=float, dest="rate", default=5.0, 
+						help="maximum wolfram requests per second with -j, "
+						"default is 5")
+	parser.add_argument("--serve", action="store_true", dest="serve", 
+						default=False, help="run as a resident server, "
+						"answering queries on a unix socket")
+	parser.add_argument("--socket", type=str, dest="socket", 
+						default=default_socket, help="unix socket path "
+						"for --serve, default is {}".format(default_socket))
+	parser.add_argument("--cache", type=str, dest="cache", default=None, 
+						metavar="FILE", help="cache wolfram results in the "
+						"sqlite database FILE")
+	parser.add_argument("--cache-ttl", type=float, dest="cache_ttl", 
+						default=30*24*3600.0, help="seconds before a cached "
+						"result expires, default is 30 days")
+	parser.add_argument("--cache-size", type=int, dest="cache_size", 
+						default=10**4, help="maximum number of cached "
+						"results, default is 10000")
 	results = parser.parse_args()
+	modes = [results.batch is not None, results.to_evaluate is not None, 
+			 results.serve]
+	if sum(modes) != 1:
+		parser.error("give one of a string to evaluate, --batch FILE, "
+					 "or --serve")
+	if results.cache is None:
+		cache = None
+	else:
+		cache = WolframCache(results.cache, ttl=results.cache_ttl, 
+							 max_size=results.cache_size)
 	# evaluate input
-	print calculate(results.to_evaluate, force_wolfram=results.wolfram)
\ No newline at end of file
+	if results.serve:
+		server = CalCalcServer(results.socket, cache=cache)
+		print "CalCalc serving on {}, press Control-C to exit".format(
+			results.socket)
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		server.server_close()
+	elif results.batch is None:
+		print calculate(results.to_evaluate, force_wolfram=results.wolfram,
+						cache=cache)
+	else:
+		if results.batch == "-":
+			batch_file = sys.stdin
+		else:
+			batch_file = open(results.batch)
+		targets = (line.rstrip("\n") for line in batch_file if line.strip())
+		start = time.time()
+		count = 0
+		if results.workers is None:
+			pool = None
+		else:
+			pool = WolframPool(workers=results.workers, rate=results.rate)
+		for result in calculate_many(targets, force_wolfram=results.wolfram, 
+									 cache=cache, pool=pool):
+			print result
+			count += 1
+		elapsed = time.time() - start
+		if pool is not None:
+			pool.close()
+		batch_file.close()
+		if results.timing:
+			sys.stderr.write("evaluated {} expressions in {:.3f} sec, "
+							 "{:.0f} per sec\n".format(count, elapsed, 
+							 count/max(elapsed, 1e-9)))
+			if cache is not None:
+				sys.stderr.write("wolfram cache: {hits} hits, {misses} "
+								 "misses, {size} entries\n".format(
+								 **cache.stats()))
+	if cache is not None:
+		cache.close()
\ No newline at end of file
@@ -0,0 +1,61 @@
+"""calc_client: Thin client for a resident CalCalc server"""
+
+# Ryan Janish
+
+# only socket and sys are imported, so that starting the client is as
+# cheap as possible; all evaluation happens in the server started with
+#	$ python CalCalc.py --serve
+import socket
+import sys
+
+default_socket = "/tmp/calcalc.sock"
+
+class CalCalcClient(object):
+	"""
+	Connection to a CalCalc server listening on the unix socket at path.
+	The connection is kept open, so that each query costs only one round
+	trip over the socket.
+	"""
+	def __init__(self, path=default_socket):
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.connect(path)
+		self.stream = self.sock.makefile("r")
+
+	def calculate(self, target):
+		""" Evaluate the target string on the server, return result string """
+		self.sock.sendall(target.replace("\n", " ") + "\n")
+		return self.stream.readline().rstrip("\n").decode("string_escape")
+
+	def calculate_many(self, targets, batch_size=256):
+		"""
+		Evaluate each string in targets on the server, sending batch_size 
+		of them at a time before reading their results, which keeps the 
+		socket buffers from filling.  Returns a list of result strings.
+		"""
+		targets = [target.replace("\n", " ") for target in targets]
+		results = []
+		for start in xrange(0, len(targets), batch_size):
+			batch = targets[start:start + batch_size]
+			self.sock.sendall("".join(target + "\n" for target in batch))
+			results += [self.stream.readline().rstrip("\n")
+						.decode("string_escape") for target in batch]
+		return results
+
+	def close(self):
+		self.stream.close()
+		self.sock.close()
+
+if __name__ == '__main__':
+	# usage: calc_client.py [-s socket] [string to evaluate]
+	# with no string to evaluate, each line of stdin is evaluated
+	args = sys.argv[1:]
+	path = default_socket
+	if args[:1] == ["-s"]:
+		path, args = args[1], args[2:]
+	client = CalCalcClient(path)
+	if args:
+		print client.calculate(" ".join(args))
+	else:
+		for line in sys.stdin:
+			print client.calculate(line.rstrip("\n"))
+	client.close()
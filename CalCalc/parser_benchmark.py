@@ -0,0 +1,114 @@
+"""Benchmark the streaming wolfram xml parser against whole-body regexes"""
+
+# Ryan Janish
+
+import argparse
+import os
+import re
+import time
+from StringIO import StringIO
+
+from CalCalc import (parse_wolfram_stream, wolfram_host, wolfram_query_path,
+					 ReadURL)
+
+class CountingStream(object):
+	""" File-like wrapper around a string that counts the bytes read """
+	def __init__(self, data):
+		self.stream = StringIO(data)
+		self.bytes_read = 0
+
+	def read(self, size=-1):
+		data = self.stream.read(size)
+		self.bytes_read += len(data)
+		return data
+
+def parse_regex(stream):
+	"""
+	The original parser: read the whole response, then search it with
+	DOTALL regexes for the first plain text in a 'Result' pod
+	"""
+	full_results = stream.read()
+	results_pod_re = re.compile(r"<pod title='Result'.*?</pod>", re.DOTALL)
+	plaintext_re = re.compile(r"<plaintext>(.*?)</plaintext>", re.DOTALL)
+	for pod_match in results_pod_re.finditer(full_results):
+		result = plaintext_re.search(pod_match.group())
+		if result is not None:
+			return result.group(1)
+	return None
+
+def synthetic_response(image_pods):
+	"""
+	Build a wolfram-like xml response with the result pod near the top,
+	followed by image_pods image-heavy pods, as is typical for queries
+	about physical constants
+	"""
+	pod = ("<pod title='{0}' scanner='Data' id='{0}' position='{1}' "
+		   "error='false' numsubpods='1'><subpod title=''><plaintext>"
+		   "{2}</plaintext><img src='http://www4b.wolframalpha.com/Calculate"
+		   "/MSP/MSP{1}{3}?MSPStoreType=image/gif&amp;s=1' alt='{2}' "
+		   "title='{2}' width='400' height='300' /></subpod></pod>")
+	padding = "a1b2c3d4e5f6"*40
+	pods = [pod.format("Input interpretation", 100, "proton mass", padding),
+			pod.format("Result", 200, "938.272 MeV/c^2", padding)]
+	pods += [pod.format("Plot", 300 + n, "", padding)
+			 for n in range(image_pods)]
+	return ("<?xml version='1.0' encoding='UTF-8'?><queryresult "
+			"success='true' error='false' numpods='{}'>{}</queryresult>"
+			"".format(len(pods), "".join(pods)))
+
+def load_fixtures(fixture_dir):
+	""" Return a dict of fixture names to xml responses """
+	fixtures = {}
+	if os.path.isdir(fixture_dir):
+		for name in sorted(os.listdir(fixture_dir)):
+			if name.endswith(".xml"):
+				with open(os.path.join(fixture_dir, name)) as fixture:
+					fixtures[name] = fixture.read()
+	if not fixtures:
+		for image_pods in [10, 100, 1000, 10000]:
+			name = "synthetic_{}_pods".format(image_pods)
+			fixtures[name] = synthetic_response(image_pods)
+	return fixtures
+
+def record(request, fixture_dir):
+	""" Save the raw wolfram response to request in fixture_dir """
+	if not os.path.isdir(fixture_dir):
+		os.makedirs(fixture_dir)
+	url = "http://{}{}".format(wolfram_host, wolfram_query_path(request))
+	filename = "{}/{}.xml".format(fixture_dir, re.sub(r"\W+", "_", request))
+	with ReadURL(url) as wolfram_search:
+		with open(filename, "w") as fixture:
+			fixture.write(wolfram_search.read())
+	print "recorded {}".format(filename)
+
+def benchmark(fixtures, trials):
+	print "{:<26}{:>10}  {:>12}{:>12}  {:>12}{:>12}".format("fixture",
+		"size (kB)", "regex (ms)", "read (kB)", "stream (ms)", "read (kB)")
+	for name in sorted(fixtures, key=lambda name: len(fixtures[name])):
+		xml = fixtures[name]
+		row = [name, len(xml)/1024.0]
+		for parser in [parse_regex, parse_wolfram_stream]:
+			times = []
+			for trial in range(trials):
+				stream = CountingStream(xml)
+				start = time.time()
+				parser(stream)
+				times.append(time.time() - start)
+			row += [1000*min(times), stream.bytes_read/1024.0]
+		print ("{:<26}{:>10.1f}  {:>12.3f}{:>12.1f}  {:>12.3f}"
+			   "{:>12.1f}".format(*row))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser("Benchmark wolfram xml parsing")
+	parser.add_argument("--fixtures", type=str, default="fixtures",
+						help="directory of recorded xml responses, if it "
+						"does not exist synthetic responses are used")
+	parser.add_argument("--record", type=str, default=None, metavar="QUERY",
+						help="record the wolfram response to QUERY as a "
+						"fixture, uses one call from the app id quota")
+	parser.add_argument("--trials", type=int, default=20,
+						help="timing trials per fixture, the best is shown")
+	args = parser.parse_args()
+	if args.record is not None:
+		record(args.record, args.fixtures)
+	benchmark(load_fixtures(args.fixtures), args.trials)
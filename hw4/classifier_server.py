@@ -0,0 +1,407 @@
+'''
+Resident image classification server.  The classifier is loaded once and
+kept warm, and images are classified over HTTP.  The images of requests
+arriving together are featurized and classified together in micro-batches,
+which amortizes the cost of each predict call over many images.
+
+Start the server with a classifier saved by construct_classifier:
+    $ python classifier_server.py --forest trained_classifier --image-root .
+and classify images with ClassifierClient, or with plain HTTP:
+    POST /classify  json {"paths": [...]} of image files under the 
+                    server's image root, or the bytes of one image file, 
+                    returns json {"categories": [...]}
+    GET /metrics    json of request latency percentiles, queue depth and
+                    batch statistics
+'''
+
+# Ryan Janish
+
+import os
+import json
+import time
+import Queue
+import httplib
+import argparse
+import threading
+from StringIO import StringIO
+from collections import deque
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+from scipy.ndimage import imread
+
+from image_classifier import ImageFeaturizer, load_classifier
+
+default_port = 8022
+
+class ClassificationRequest(object):
+    ''' Images waiting to be classified, and their categories once done '''
+    def __init__(self, images):
+        self.images = images
+        self.received = time.time()
+        self.done = threading.Event()
+        self.categories = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.categories
+
+
+class MicroBatcher(object):
+    '''
+    Classifies images on a background thread in micro-batches.  Requests
+    are put on a queue of at most queue_size requests, so that submitting
+    blocks when the server is overloaded.  The batcher takes the first
+    waiting request, then keeps taking requests until it has max_batch
+    images or max_delay seconds have passed, and featurizes and classifies
+    all of their images together.  A request with an image that cannot be
+    featurized, or whose features are not finite, such as an all black 
+    image, fails on its own without failing the rest of its batch.
+
+    Arguments:
+    ---------------
+    clf - trained classifier
+    featurizer - ImageFeaturizer with the features clf was trained on
+    max_batch - most images in a batch, a single request may exceed it
+    max_delay - longest time in seconds to wait for a batch to fill
+    queue_size - most requests waiting to be batched
+    history - number of recent requests kept for the latency percentiles
+    '''
+    def __init__(self, clf, featurizer, max_batch=64, max_delay=0.005,
+                 queue_size=1024, history=10000):
+        self.clf = clf
+        self.featurizer = featurizer
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = Queue.Queue(queue_size)
+        self.latencies = deque(maxlen=history)
+        self.batch_sizes = deque(maxlen=history)
+        self.batch_times = deque(maxlen=history)
+        self.requests = 0
+        self.images = 0
+        self.max_queue_depth = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, images):
+        ''' classify a list of image arrays, returns a list of categories '''
+        request = ClassificationRequest(images)
+        self.queue.put(request)
+        with self.lock:
+            self.max_queue_depth = max(self.max_queue_depth,
+                                       self.queue.qsize())
+        return request.wait()
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            request = self.queue.get()
+            if request is None:
+                break
+            batch = [request]
+            size = len(request.images)
+            deadline = time.time() + self.max_delay
+            while size < self.max_batch:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=timeout)
+                except Queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+                size += len(request.images)
+            self.classify(batch)
+
+    def featurize(self, batch):
+        '''
+        features of the images of each request in batch, featurized 
+        together, or each request on its own if that fails.  The requests
+        that cannot be featurized, or whose features are not finite, get 
+        their error and are left out.  Returns the requests left and a 
+        features array of all of their images.
+        '''
+        images = [image for request in batch for image in request.images]
+        try:
+            features = np.array(self.featurizer.featurize_images(images),
+                                dtype=float)
+            counts = [len(request.images) for request in batch]
+            request_features = np.split(features, np.cumsum(counts)[:-1])
+        except Exception:
+            request_features = []
+            for request in batch:
+                try:
+                    request_features.append(np.array(
+                        self.featurizer.featurize_images(request.images),
+                        dtype=float))
+                except Exception as error:
+                    request.error = error
+                    request_features.append(None)
+        valid, valid_features = [], []
+        for request, features in zip(batch, request_features):
+            if features is None:
+                continue
+            if not np.all(np.isfinite(features)):
+                request.error = ValueError("image features are not finite, "
+                                           "the image may be all black")
+                continue
+            valid.append(request)
+            valid_features.append(features)
+        if not valid:
+            return valid, None
+        return valid, np.vstack(valid_features)
+
+    def classify(self, batch):
+        ''' featurize and classify the images of a batch of requests '''
+        start = time.time()
+        images = [image for request in batch for image in request.images]
+        valid, features = self.featurize(batch)
+        if valid:
+            try:
+                categories = list(self.clf.predict(features))
+            except Exception as error:
+                for request in valid:
+                    request.error = error
+            else:
+                for request in valid:
+                    count = len(request.images)
+                    request.categories, categories = (categories[:count],
+                                                      categories[count:])
+        finished = time.time()
+        with self.lock:
+            self.requests += len(batch)
+            self.images += len(images)
+            self.batch_sizes.append(len(images))
+            self.batch_times.append(finished - start)
+            for request in batch:
+                self.latencies.append(finished - request.received)
+        for request in batch:
+            request.done.set()
+
+    def metrics(self):
+        ''' dict of request latency, queue depth and batch statistics '''
+        with self.lock:
+            latencies = np.array(self.latencies)
+            metrics = {'requests':self.requests, 'images':self.images,
+                       'batches':len(self.batch_sizes),
+                       'queue_depth':self.queue.qsize(),
+                       'max_queue_depth':self.max_queue_depth}
+            if len(self.batch_sizes) > 0:
+                metrics['mean_batch_size'] = float(np.mean(self.batch_sizes))
+                metrics['mean_batch_sec'] = float(np.mean(self.batch_times))
+        for percentile in [50, 90, 99]:
+            if len(latencies) > 0:
+                metrics['latency_p{}_sec'.format(percentile)] = float(
+                    np.percentile(latencies, percentile))
+        return metrics
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+class ClassifierHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length', 0))
+        body = self.rfile.read(length)
+        if self.path != '/classify':
+            return self.reply(404, {'error':'unknown path ' + self.path})
+        try:
+            content_type = self.headers.getheader('content-type', '')
+            if content_type.startswith('application/json'):
+                paths = [self.server.resolve_path(path) 
+                         for path in json.loads(body)['paths']]
+                images = [imread(path).astype(float) for path in paths]
+            else:
+                images = [imread(StringIO(body)).astype(float)]
+        except PermissionError as error:
+            return self.reply(403, {'error':str(error)})
+        except Exception as error:
+            return self.reply(400, {'error':str(error)})
+        try:
+            categories = self.server.batcher.submit(images)
+        except Exception as error:
+            return self.reply(500, {'error':str(error)})
+        self.reply(200, {'categories':[str(cat) for cat in categories]})
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            return self.reply(404, {'error':'unknown path ' + self.path})
+        self.reply(200, self.server.batcher.metrics())
+
+    def reply(self, status, result):
+        body = json.dumps(result)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PermissionError(Exception):
+    ''' Raised for image paths outside the server's image root '''
+    pass
+
+
+class ClassifierServer(ThreadingMixIn, HTTPServer):
+    '''
+    HTTP server that classifies images with the classifier saved in the
+    directory forest, see image_classifier.save_classifier.  Each
+    connection is handled on its own thread, and all threads submit their
+    images to one MicroBatcher, created with the keyword arguments
+    batcher_args once the server is bound.  Requests may name image files
+    only inside the directory image_root, and if it is None only image 
+    bytes are accepted.
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, forest='trained_classifier', image_root=None,
+                 **batcher_args):
+        featurizer = ImageFeaturizer()
+        clf = load_classifier(forest, featurizer=featurizer)['classifier']
+        if image_root is not None:
+            image_root = os.path.realpath(image_root)
+        self.image_root = image_root
+        self.batcher = None
+        HTTPServer.__init__(self, address, ClassifierHandler)
+        # started only once the socket is bound, so a failed bind leaves 
+        # no thread running
+        try:
+            self.batcher = MicroBatcher(clf, featurizer, **batcher_args)
+        except Exception:
+            self.server_close()
+            raise
+
+    def resolve_path(self, path):
+        ''' 
+        real path of the image file path, relative to the image root if 
+        not absolute, raising PermissionError if it is outside the root
+        '''
+        if self.image_root is None:
+            raise PermissionError("this server does not read image files, "
+                                  "send the image bytes instead")
+        real_path = os.path.realpath(os.path.join(self.image_root, path))
+        if not real_path.startswith(os.path.join(self.image_root, '')):
+            raise PermissionError("{} is outside the image root".format(
+                                  path))
+        return real_path
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        if self.batcher is not None:
+            self.batcher.close()
+            self.batcher = None
+
+
+class ClassifierClient(object):
+    '''
+    Connection to a ClassifierServer, kept open between requests
+    '''
+    def __init__(self, host='localhost', port=default_port):
+        self.connection = httplib.HTTPConnection(host, port)
+
+    def request(self, method, path, body=None, headers={}):
+        self.connection.request(method, path, body, headers)
+        response = self.connection.getresponse()
+        result = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(result['error'])
+        return result
+
+    def classify_paths(self, paths):
+        ''' categories of the image files in the list paths '''
+        body = json.dumps({'paths':[os.path.abspath(path) 
+                                    for path in paths]})
+        return self.request('POST', '/classify', body,
+                            {'Content-Type':'application/json'})['categories']
+
+    def classify_bytes(self, data):
+        ''' category of the image file contents in the string data '''
+        return self.request('POST', '/classify', data,
+                            {'Content-Type':'application/octet-stream'}
+                            )['categories'][0]
+
+    def metrics(self):
+        return self.request('GET', '/metrics')
+
+    def close(self):
+        self.connection.close()
+
+
+def test_1():
+    from sklearn.ensemble import RandomForestClassifier
+    featurizer = ImageFeaturizer()
+    random = np.random.RandomState(0)
+    clf = RandomForestClassifier(n_estimators=5).fit(
+        random.rand(20, len(featurizer.feature_names())), ['a', 'b']*10)
+    batcher = MicroBatcher(clf, featurizer, max_delay=1.0)
+    good = random.randint(1, 256, (32, 32, 3)).astype(float)
+    black = np.zeros((32, 32, 3))
+    results = {}
+    def submit(name, images):
+        try:
+            results[name] = batcher.submit(images)
+        except Exception as error:
+            results[name] = error
+    threads = [threading.Thread(target=submit, args=(name, images)) for
+               name, images in [('good', [good, good]), ('black', [black])]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+    assert batcher.metrics()['batches'] == 1
+    assert len(results['good']) == 2
+    assert all(category in ['a', 'b'] for category in results['good'])
+    assert isinstance(results['black'], ValueError)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve an image "
+                                     "classifier over HTTP")
+    parser.add_argument("--forest", type=str, default="trained_classifier",
+                        help="classifier directory saved by "
+                        "construct_classifier")
+    parser.add_argument("--image-root", type=str, default=None, 
+                        dest="image_root", help="directory of the image "
+                        "files that requests may name, by default only "
+                        "image bytes are accepted")
+    parser.add_argument("--host", type=str, default="localhost")
+    parser.add_argument("--port", type=int, default=default_port)
+    parser.add_argument("--max-batch", type=int, default=64,
+                        dest="max_batch", help="most images per batch")
+    parser.add_argument("--max-delay", type=float, default=0.005,
+                        dest="max_delay", help="longest wait in seconds "
+                        "for a batch to fill")
+    parser.add_argument("--queue-size", type=int, default=1024,
+                        dest="queue_size", help="most requests waiting "
+                        "to be batched")
+    args = parser.parse_args()
+    server = ClassifierServer((args.host, args.port), forest=args.forest,
+                              image_root=args.image_root,
+                              max_batch=args.max_batch,
+                              max_delay=args.max_delay,
+                              queue_size=args.queue_size)
+    print "serving {} on http://{}:{}".format(args.forest, args.host,
+                                              args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
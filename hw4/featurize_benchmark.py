@@ -0,0 +1,79 @@
+'''
+Benchmark the batched, vectorized featurization of equal size images
+against featurizing them one at a time.  Uses the images in a directory
+if one is given, otherwise random rgb thumbnails.
+'''
+
+# Ryan Janish
+
+import os
+import time
+import glob
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+from scipy.misc import imsave
+
+from image_classifier import ImageFeaturizer
+
+def make_thumbnails(directory, count, shape):
+    ''' write count random images of the given shape to directory '''
+    images = []
+    for n in range(count):
+        filename = "{}/thumbnail_{}.png".format(directory, n)
+        imsave(filename, np.random.randint(0, 256, shape).astype(np.uint8))
+        images.append(filename)
+    return images
+
+def time_featurizer(images, batch_size, trials):
+    ''' best time over trials to featurize images, and the features '''
+    times = []
+    for trial in range(trials):
+        start = time.time()
+        featurizer = ImageFeaturizer(images, batch_size=batch_size)
+        times.append(time.time() - start)
+    return min(times), featurizer
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark batched "
+                                     "featurization of equal size images")
+    parser.add_argument("image_dir", nargs="?", default=None,
+                        help="directory of images, default is random "
+                        "thumbnails")
+    parser.add_argument("--count", type=int, default=500,
+                        help="number of random thumbnails")
+    parser.add_argument("--shape", type=int, nargs=3, default=[64, 64, 3],
+                        help="shape of the random thumbnails")
+    parser.add_argument("--batch-sizes", type=int, nargs="+",
+                        default=[16, 64, 256], dest="batch_sizes")
+    parser.add_argument("--trials", type=int, default=3,
+                        help="timing trials, the best is shown")
+    args = parser.parse_args()
+    if args.image_dir is None:
+        image_dir = tempfile.mkdtemp()
+        images = make_thumbnails(image_dir, args.count, args.shape)
+    else:
+        image_dir = None
+        images = sorted(glob.glob(os.path.join(args.image_dir, "*")))
+    try:
+        single_time, single = time_featurizer(images, None, args.trials)
+        single_features = single.get_features()
+        print "{} images".format(len(images))
+        print "{:<12}{:>12}{:>14}{:>10}{:>14}".format("batch size",
+            "time (sec)", "images/sec", "speedup", "max diff")
+        print "{:<12}{:>12.3f}{:>14.1f}{:>10.2f}{:>14}".format("single",
+            single_time, len(images)/single_time, 1.0, "-")
+        for batch_size in args.batch_sizes:
+            batch_time, batch = time_featurizer(images, batch_size,
+                                                args.trials)
+            difference = np.abs(batch.get_features() - single_features).max()
+            print "{:<12}{:>12.3f}{:>14.1f}{:>10.2f}{:>14.2e}".format(
+                batch_size, batch_time, len(images)/batch_time,
+                single_time/batch_time, difference)
+        print "\nper feature times, batch size {}:".format(batch_size)
+        print batch.timing_report()
+    finally:
+        if image_dir is not None:
+            shutil.rmtree(image_dir)
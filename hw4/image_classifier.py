@@ -3,14 +3,117 @@ import os
 import sys
 import pickle
 import time
+import inspect
+import shutil
+import hashlib
+import sqlite3
+import fnmatch
+import tempfile
+from stat import S_ISDIR, S_ISREG
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
-from numpy.random import shuffle as npshuffle
 from scipy.ndimage import imread
 from sklearn.ensemble import RandomForestClassifier
+from sklearn.externals import joblib
 from sklearn import cross_validation as cval
 from skimage.feature import peak_local_max, corner_subpix
 from skimage.filter import vsobel, hsobel
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+def uses(*intermediates):
+    '''
+    Decorator for feature methods of ImageFeaturizer, declaring the names
+    of the ImageIntermediates they need
+    '''
+    def declare(feature_func):
+        feature_func.intermediates = intermediates
+        return feature_func
+    return declare
+
+def vectorized(stack_method):
+    '''
+    Decorator for feature methods of ImageFeaturizer, naming the method 
+    that computes the same features for a whole stack of equal size 
+    images at once, see ImageFeaturizer.featurize_stack
+    '''
+    def declare(feature_func):
+        feature_func.stack_method = stack_method
+        return feature_func
+    return declare
+
+
+class ImageIntermediates(object):
+    '''
+    Intermediate results shared between the features of a single image.  
+    Each intermediate is a method of this class, computed the first time
+    it is looked up with image[name] and then stored, so that it is only
+    computed once per image however many features use it.  The time spent
+    computing each intermediate is kept in the timings dict.
+
+    Arguments:
+    ---------------
+    image - image array, either 2d grayscale or 3d rgb
+    '''
+
+    def __init__(self, image):
+        self.image = image
+        self.is_rgb = (len(image.shape) == 3)
+        self.values = {}
+        self.timings = {}
+
+    def __getitem__(self, name):
+        if name not in self.values:
+            start = time.time()
+            self.values[name] = getattr(self, name)()
+            self.timings[name] = time.time() - start
+        return self.values[name]
+
+    def channel_sums(self):
+        '''
+        total luminosity of the red, green and blue channels, all zero 
+        for grayscale images
+        '''
+        if not self.is_rgb:
+            return np.zeros(3)
+        return np.array([self.image[:,:,n].sum() for n in range(3)])
+
+    def total(self):
+        '''total luminosity over all channels'''
+        return self.image.sum()
+
+    def gray(self):
+        '''grayscale image, the sum over color channels'''
+        if self.is_rgb:
+            return self.image.sum(axis=2)
+        return self.image
+
+    def vsobel(self):
+        '''vertical sobel edge map of the grayscale image'''
+        return vsobel(self['gray'])
+
+    def hsobel(self):
+        '''horizontal sobel edge map of the grayscale image'''
+        return hsobel(self['gray'])
+
+    def peaks(self):
+        '''local maxima of the grayscale image'''
+        return peak_local_max(self['gray'])
+
+    def valleys(self):
+        '''local minima of the grayscale image'''
+        gray = self['gray']
+        return peak_local_max(np.max(gray) - gray)
+
 
 class ImageFeaturizer(object):
     '''
@@ -28,47 +131,316 @@ class ImageFeaturizer(object):
     form: "feature_1__feature_2__feature_3()", where the double underscore
     will be used to compute a list of individual feature names. 
 
+    Images can be featurized in parallel over a pool of n_jobs worker 
+    processes, and the features of each image can be cached on disk, so
+    that they are only computed again if the image file or the definition
+    of the features changes.
+
+    For datasets larger than memory, features can instead be streamed into
+    a float32 memmap file, preallocated with one row per image.  Each row 
+    is written as soon as its image is featurized, and the image is then
+    discarded, so memory use does not grow with the number of images.
+
+    Images can also be featurized in batches of batch_size.  The images of
+    a batch that have the same shape are stacked into one (B, H, W, C) 
+    array, and features that have a vectorized stack version, declared 
+    with the @vectorized decorator, are computed for the whole stack with 
+    numpy reductions rather than image by image.  This is much faster for
+    datasets of many equal size thumbnails.
+
     Arguments:
     ---------------
     images - list of image filenames to featureize 
+    n_jobs - number of worker processes to use, -1 for one per core, 
+        default is 1, which featurizes in this process
+    chunksize - number of images sent to a worker at a time
+    cache_file - sqlite file for cached features, default is None, which
+        disables the cache
+    memmap_file - file to hold the memmap feature matrix in streaming mode, 
+        default is None, which keeps features in memory
+    batch_size - number of images read and featurized together, default 
+        is None, which featurizes one image at a time
+    read_threads - number of threads decoding images ahead of their 
+        featurization when featurizing in this process, see iter_images, 
+        default is 2, 0 reads each image when it is featurized
     '''
 
-    def __init__(self, images=[]):
-        DEFAULT_FEATURES_RGB = [self.red_frac__green_frac__blue_frac,
-                                self.red_std__green_std__blue_std,
-                                self.rgb_theta__rgb_phi]
-        DEFAULT_FEATURES_GRAY = [self.frac_peaks,
-                                 self.frac_valleys,
-                                 self.frac_hedges__frac_vedges,
-                                 self.im_std,
-                                 self.g11__g12__g13__g14__g21__g22__g23__g34__g31__g32__g33__g34__g41__g42__g34__g44]
-        self.rgb_features_to_use = DEFAULT_FEATURES_RGB
-        self.gray_features_to_use = DEFAULT_FEATURES_GRAY
-        self.features_to_use = DEFAULT_FEATURES_RGB + DEFAULT_FEATURES_GRAY
-        self.features = []
+    def __init__(self, images=[], n_jobs=1, chunksize=8, cache_file=None,
+                 memmap_file=None, batch_size=None, read_threads=2):
+        DEFAULT_FEATURES = [self.red_frac__green_frac__blue_frac,
+                            self.red_std__green_std__blue_std,
+                            self.rgb_theta__rgb_phi,
+                            self.frac_peaks,
+                            self.frac_valleys,
+                            self.frac_hedges__frac_vedges,
+                            self.im_std,
+                            self.g11__g12__g13__g14__g21__g22__g23__g34__g31__g32__g33__g34__g41__g42__g34__g44]
+        self.features_to_use = DEFAULT_FEATURES
+        self.timings = {}
+        self.memmap_file = memmap_file
+        if memmap_file is None:
+            self.features = []
+        else:
+            open(memmap_file, 'wb').close()
+            self.features = np.zeros((0, len(self.feature_names())), 
+                                     dtype=np.float32)
+        if n_jobs == -1:
+            n_jobs = cpu_count()
+        self.n_jobs = n_jobs
+        self.chunksize = chunksize
+        self.batch_size = batch_size
+        self.read_threads = read_threads
+        if cache_file is None:
+            self.cache = None
+        else:
+            self.cache = FeatureCache(cache_file)
         self.compute_features(images)
 
     def compute_features(self, images):
         ''' 
         Read each image in the passed list of image filename, and compute 
         each feature in self.features_to_use for each image.  Results are 
-        stored in 2d list self.features
+        stored in 2d list self.features, or in streaming mode in the rows 
+        of the memmap self.features, in the same order as images.  Images 
+        with current entries in the feature cache are not read.
         '''
-        for im_filename in images:
-            im = imread(im_filename).astype(float)
-            im_features = []
-            for feature_func in self.rgb_features_to_use:
-                im_features += feature_func(im)
-            if len(im.shape) == 3:
-              gray = im.sum(axis=2)
+        images = list(images)
+        if self.memmap_file is None:
+            image_features = [None]*len(images)
+        else:
+            image_features = self.allocate_rows(len(images))
+        to_compute = range(len(images))
+        if self.cache is not None:
+            signature = self.feature_signature()
+            stats = [os.stat(im_filename) for im_filename in images]
+            to_compute = []
+            for n, (im_filename, stat) in enumerate(zip(images, stats)):
+                features = self.cache.get(im_filename, stat.st_mtime,
+                                          stat.st_size, signature)
+                if features is None:
+                    to_compute.append(n)
+                else:
+                    image_features[n] = features
+        filenames = [images[n] for n in to_compute]
+        # in streaming mode the rows are float32, so the features are 
+        # cached as computed rather than read back from their rows
+        computed = []
+        for n, features in zip(to_compute, self.featurize_all(filenames)):
+            image_features[n] = features
+            if self.cache is not None:
+                computed.append(features)
+        if self.cache is not None:
+            self.cache.put([(images[n], stats[n].st_mtime, stats[n].st_size, 
+                             signature, features) 
+                            for n, features in zip(to_compute, computed)])
+        if self.memmap_file is None:
+            self.features += image_features
+        elif isinstance(self.features, np.memmap):
+            self.features.flush()
+
+    def featurize_all(self, filenames):
+        '''
+        Generate the features of each image in filenames, in order, as 
+        each is computed, using a pool of n_jobs processes if n_jobs > 1.
+        With a batch_size, each batch of images is featurized together 
+        and its features are generated when the whole batch is done.  In
+        this process, images are decoded ahead on read_threads threads.
+        '''
+        if self.batch_size is None:
+            tasks = filenames
+            worker_task, chunksize = featurize_with_worker, self.chunksize
+        else:
+            tasks = [filenames[start:start + self.batch_size] 
+                     for start in range(0, len(filenames), self.batch_size)]
+            worker_task, chunksize = featurize_batch_with_worker, 1
+        if self.n_jobs > 1 and len(tasks) > 1:
+            names = [f.func_name for f in self.features_to_use]
+            workers = Pool(self.n_jobs, initializer=init_featurizer, 
+                           initargs=(names,))
+            # terminated if a worker raises or the caller stops early
+            try:
+                for features, timings in workers.imap(worker_task, tasks, 
+                                                      chunksize=chunksize):
+                    self.add_timings(timings)
+                    if self.batch_size is None:
+                        yield features
+                    else:
+                        for im_features in features:
+                            yield im_features
+                workers.close()
+                workers.join()
+            finally:
+                workers.terminate()
+        else:
+            images = iter_images(filenames, threads=self.read_threads, 
+                                 prefetch=max(8, self.batch_size))
+            for task in tasks:
+                if self.batch_size is None:
+                    yield self.featurize_image(next(images)[1])
+                else:
+                    batch = [image for im_filename, image in 
+                             islice(images, len(task))]
+                    for im_features in self.featurize_images(batch):
+                        yield im_features
+
+    def allocate_rows(self, count):
+        '''
+        Extend the memmap feature matrix in streaming mode by count rows, 
+        and return a view of the new rows
+        '''
+        n_features = len(self.feature_names())
+        start = self.features.shape[0]
+        if count == 0:
+            return self.features[start:]
+        with open(self.memmap_file, 'r+b') as memmap_file:
+            memmap_file.truncate((start + count)*n_features*4)
+        self.features = np.memmap(self.memmap_file, dtype=np.float32, 
+                                  mode='r+', shape=(start + count, n_features))
+        return self.features[start:]
+
+    def featurize(self, im_filename):
+        ''' 
+        Read one image and return the list of all of its features.  The
+        intermediates declared by each feature are computed before it, 
+        each only once per image, and the time spent on every feature 
+        and intermediate is added to self.timings.
+        '''
+        return self.featurize_image(imread(im_filename).astype(float))
+
+    def featurize_image(self, image):
+        ''' list of all features of one image array, see featurize '''
+        if not isinstance(image, ImageIntermediates):
+            image = ImageIntermediates(image)
+        im_features = []
+        timings = {}
+        for feature_func in self.features_to_use:
+            for name in getattr(feature_func, 'intermediates', []):
+                image[name]
+            start = time.time()
+            im_features += feature_func(image)
+            timings[feature_func.func_name] = time.time() - start
+        for name, seconds in image.timings.items():
+            timings['[{}]'.format(name)] = seconds
+        self.add_timings(timings)
+        return im_features
+
+    def featurize_batch(self, filenames):
+        '''
+        Read a batch of images and return the list of the features of 
+        each, in order, see featurize_images
+        '''
+        return self.featurize_images([imread(im_filename).astype(float) 
+                                      for im_filename in filenames])
+
+    def featurize_images(self, images):
+        '''
+        List of the features of each image array in images, in order.  
+        Images of the same shape are featurized together as one stack by 
+        featurize_stack.
+        '''
+        shapes = {}
+        for n, image in enumerate(images):
+            shapes.setdefault(image.shape, []).append(n)
+        batch_features = [None]*len(images)
+        for shape, indices in shapes.items():
+            if len(indices) == 1 or min(shape[:2]) < 4:
+                # too small to split into the 4x4 grid by slicing
+                for n in indices:
+                    batch_features[n] = self.featurize_image(images[n])
             else:
-              gray = im
-            for feature_func in self.gray_features_to_use:
-                im_features += feature_func(gray)
-            self.features.append(im_features)
+                stack = np.array([images[n] for n in indices])
+                stack_features = self.featurize_stack(stack)
+                for n, im_features in zip(indices, stack_features):
+                    batch_features[n] = list(im_features)
+        return batch_features
+
+    def featurize_stack(self, stack):
+        '''
+        Features of a stack of equal size images, given as one array of
+        shape (B, H, W, C) for rgb or (B, H, W) for grayscale images.  
+        Returns a (B, n_features) array.  Features with a stack method are 
+        computed for the whole stack at once, the others image by image.
+        The stack methods are passed the color channels as contiguous 
+        (B, C, H, W) planes, as numpy is much slower reducing over the 
+        short, interleaved channel axis, and the grayscale stack.
+        '''
+        timings = {}
+        start = time.time()
+        if stack.ndim == 4:
+            planes = np.ascontiguousarray(np.rollaxis(stack, 3, 1))
+            gray = planes.sum(axis=1)
+        else:
+            planes, gray = None, stack
+        timings['[gray]'] = time.time() - start
+        images = None
+        columns = []
+        for feature_func in self.features_to_use:
+            stack_method = getattr(feature_func, 'stack_method', None)
+            if stack_method is not None:
+                start = time.time()
+                columns.append(getattr(self, stack_method)(planes, gray))
+            else:
+                if images is None:
+                    images = [ImageIntermediates(image) for image in stack]
+                    for image, image_gray in zip(images, gray):
+                        image.values['gray'] = image_gray
+                for image in images:
+                    for name in getattr(feature_func, 'intermediates', []):
+                        image[name]
+                start = time.time()
+                columns.append(np.array([feature_func(image) 
+                                         for image in images]))
+            timings[feature_func.func_name] = time.time() - start
+        for image in images or []:
+            for name, seconds in image.timings.items():
+                name = '[{}]'.format(name)
+                timings[name] = timings.get(name, 0.0) + seconds
+        self.add_timings(timings)
+        return np.hstack(columns)
+
+    def add_timings(self, timings):
+        ''' add a dict of seconds spent per feature to self.timings '''
+        for name, seconds in timings.items():
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def timing_report(self):
+        '''
+        Table of the total time spent on each feature and, in brackets, 
+        each shared intermediate, over all images featurized so far, 
+        most expensive first
+        '''
+        total = sum(self.timings.values())
+        lines = ["{:<40}{:>12}{:>8}".format("feature", "time (sec)", "%")]
+        for name in sorted(self.timings, key=self.timings.get, reverse=True):
+            seconds = self.timings[name]
+            lines.append("{:<40}{:>12.3f}{:>8.1f}".format(name[:39], seconds,
+                         100*seconds/max(total, 1e-12)))
+        return "\n".join(lines)
+
+    def feature_signature(self):
+        '''
+        Hash of the names and source code of the features in use, of 
+        their stack methods and of the intermediates, which changes 
+        whenever their definitions do
+        '''
+        signature = hashlib.sha1(inspect.getsource(ImageIntermediates))
+        for feature_func in self.features_to_use:
+            signature.update(feature_func.func_name)
+            signature.update(inspect.getsource(feature_func))
+            stack_method = getattr(feature_func, 'stack_method', None)
+            if stack_method is not None:
+                signature.update(inspect.getsource(getattr(self, 
+                                                           stack_method)))
+        return signature.hexdigest()
 
     def get_features(self):
-        return np.array(self.features)
+        ''' 
+        2d array of features, one row per image.  In streaming mode this 
+        is the memmap itself, not a copy.
+        '''
+        if self.memmap_file is None:
+            return np.array(self.features)
+        return self.features
 
     def feature_names(self):
         name = []
@@ -77,31 +449,34 @@ class ImageFeaturizer(object):
         return name
 
     # begin rgb feature calculators
+    @uses('channel_sums', 'total')
+    @vectorized('stack_color_fracs')
     def red_frac__green_frac__blue_frac(self, image):
         '''fraction of luminosity that is red, green and blue'''
-        if len(image.shape) == 3:
-            total = float(image.sum())
-            rgb = np.array([image[:,:,n].sum() for n in range(3)])
-            return list(rgb/total)
+        if image.is_rgb:
+            return list(image['channel_sums']/float(image['total']))
         else:
             return [0.0]*3
 
+    @vectorized('stack_color_stds')
     def red_std__green_std__blue_std(self, image):
         '''standard deviation of red, green and blue subframes'''
-        if len(image.shape) == 3:
-            std_devs = np.array([np.std(image[:,:,n]) for n in range(3)])
+        if image.is_rgb:
+            std_devs = np.array([np.std(image.image[:,:,n]) for n in range(3)])
             return list(std_devs)
         else:
             return [0.0]*3
 
+    @uses('channel_sums')
+    @vectorized('stack_rgb_angles')
     def rgb_theta__rgb_phi(self, image):
         ''' 
         represent the image as a point in R^3, with each coordinate given by 
         the sum over a rgb color channel, and then return the spherical 
         coordinate angles of the image in rgb-space
         '''
-        if len(image.shape) == 3:
-            x,y,z = [image[:,:,n].sum() for n in range(3)]
+        if image.is_rgb:
+            x,y,z = image['channel_sums']
             r = np.sqrt(x**2 + y**2 + x**2)
             try:
                 theta = np.arccos(z/r)
@@ -116,44 +491,467 @@ class ImageFeaturizer(object):
             return [0.0, 0.0]
 
     # begin grayscale feature calculators
+    @uses('gray', 'peaks')
     def frac_peaks(self, image):
         '''fraction of all grayscale pixels that are local maxima'''
-        peaks = peak_local_max(image)
-        return [peaks.shape[0]/float(image.size)]
+        return [image['peaks'].shape[0]/float(image['gray'].size)]
 
+    @uses('gray', 'valleys')
     def frac_valleys(self, image):
         '''fraction of all grayscale pixels that are local minima'''
-        valleys = peak_local_max(np.max(image)-image)
-        return [valleys.shape[0]/float(image.size)]
+        return [image['valleys'].shape[0]/float(image['gray'].size)]
 
+    @uses('gray')
+    @vectorized('stack_im_std')
     def im_std(self, image):
         '''standard deviation of grayscale image'''
-        return [np.std(image)]
+        return [np.std(image['gray'])]
 
+    @uses('vsobel', 'hsobel')
+    @vectorized('stack_edge_fracs')
     def frac_hedges__frac_vedges(self, image):
         '''
         fraction of all grayscale pixels that lie on vertical and
         horizontal edges in the image interior
         '''
-        v = vsobel(image)
-        h = hsobel(image)
-        return [v.mean(), h.mean()]
+        return [image['vsobel'].mean(), image['hsobel'].mean()]
 
+    @uses('gray')
+    @vectorized('stack_grid_fracs')
     def g11__g12__g13__g14__g21__g22__g23__g34__g31__g32__g33__g34__g41__g42__g34__g44(self, image):
         '''
         divide image into a 4x4 grid of sub pixels, compute the fraction of 
         total grayscale luminosity located in each subimage 
         '''
-        y, x = image.shape
-        total = image.sum()
+        gray = image['gray']
+        y, x = gray.shape
+        # summed from the grayscale image, not taken from 'total', which
+        # sums the channels in a different order and so rounds differently
+        total = gray.sum()
         block_weights = []
         x_divisions = np.linspace(0, x, 5).astype(int)
         y_divisions = np.linspace(0, y, 5).astype(int)
         for xi, xf in zip(x_divisions[:-1], x_divisions[1:]):
             for yi, yf in zip(y_divisions[:-1], y_divisions[1:]):
-                block_weights.append(image[yi:yf, xi:xf].sum()/total)
+                block_weights.append(gray[yi:yf, xi:xf].sum()/total)
         return block_weights
 
+    # begin vectorized stack versions of the features, each takes the 
+    # color planes (B, C, H, W) of a stack of rgb images, or None for 
+    # grayscale images, and the grayscale stack (B, H, W), and returns a 
+    # (B, n) array of the features of each image 
+    def stack_color_fracs(self, planes, gray):
+        if planes is None:
+            return np.zeros((len(gray), 3))
+        n_images = len(planes)
+        channel_sums = planes[:, :3].reshape(n_images, 3, -1).sum(axis=2)
+        total = planes.reshape(n_images, -1).sum(axis=1)
+        return channel_sums/total[:, np.newaxis]
+
+    def stack_color_stds(self, planes, gray):
+        if planes is None:
+            return np.zeros((len(gray), 3))
+        return planes[:, :3].reshape(len(planes), 3, -1).std(axis=2)
+
+    def stack_rgb_angles(self, planes, gray):
+        if planes is None:
+            return np.zeros((len(gray), 2))
+        x, y, z = planes[:, :3].reshape(len(planes), 3, -1).sum(axis=2).T
+        r = np.sqrt(x**2 + y**2 + x**2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            theta = np.arccos(z/r)
+        phi = np.arctan2(y, x)
+        valid = ((0 <= theta) & (theta <= np.pi) & 
+                 (-np.pi <= phi) & (phi <= np.pi))
+        return np.where(valid[:, np.newaxis], 
+                        np.column_stack([theta, phi]), 0.0)
+
+    def stack_im_std(self, planes, gray):
+        return gray.std(axis=(1, 2))[:, np.newaxis]
+
+    def stack_edge_fracs(self, planes, gray):
+        '''
+        same as the mean of skimage's vsobel and hsobel, which are zero on
+        the image border, computed by slicing the whole stack
+        '''
+        size = float(gray.shape[1]*gray.shape[2])
+        smooth_y = gray[:, :-2] + 2*gray[:, 1:-1] + gray[:, 2:]
+        v = np.abs(smooth_y[:, :, :-2] - smooth_y[:, :, 2:])
+        smooth_x = gray[:, :, :-2] + 2*gray[:, :, 1:-1] + gray[:, :, 2:]
+        h = np.abs(smooth_x[:, :-2] - smooth_x[:, 2:])
+        return np.column_stack([v.sum(axis=(1, 2))/(4*size), 
+                                h.sum(axis=(1, 2))/(4*size)])
+
+    def stack_grid_fracs(self, planes, gray):
+        n_images, y, x = gray.shape
+        x_divisions = np.linspace(0, x, 5).astype(int)
+        y_divisions = np.linspace(0, y, 5).astype(int)
+        blocks = np.add.reduceat(gray, y_divisions[:-1], axis=1)
+        blocks = np.add.reduceat(blocks, x_divisions[:-1], axis=2)
+        # order blocks by x then y, as in the single image version
+        blocks = blocks.transpose(0, 2, 1).reshape(n_images, 16)
+        total = gray.reshape(n_images, -1).sum(axis=1)
+        return blocks/total[:, np.newaxis]
+
+
+class FeatureCache(object):
+    '''
+    On-disk cache of image features, stored in an sqlite database.  Each
+    entry is keyed on the image filename, and is only valid while the 
+    file's modification time and size and the feature signature (see 
+    ImageFeaturizer.feature_signature) are unchanged.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.execute("CREATE TABLE IF NOT EXISTS features "
+                        "(path TEXT PRIMARY KEY, mtime REAL, size INTEGER, "
+                        "signature TEXT, features BLOB)")
+        self.db.commit()
+
+    def get(self, path, mtime, size, signature):
+        ''' Return the cached features list for path, or None if stale '''
+        row = self.db.execute("SELECT features FROM features WHERE path = ? "
+                              "AND mtime = ? AND size = ? AND signature = ?", 
+                              (os.path.abspath(path), mtime, size, 
+                               signature)).fetchone()
+        if row is None:
+            return None
+        return list(np.frombuffer(row[0], dtype=np.float64))
+
+    def put(self, entries):
+        ''' 
+        Save a list of entries, each a tuple (path, mtime, size, signature,
+        features), replacing any previous entries for the same paths
+        '''
+        rows = [(os.path.abspath(path), mtime, size, signature, 
+                 buffer(np.array(features, dtype=np.float64).tostring()))
+                for path, mtime, size, signature, features in entries]
+        self.db.executemany("INSERT OR REPLACE INTO features "
+                            "VALUES (?, ?, ?, ?, ?)", rows)
+        self.db.commit()
+
+
+# featurizer used by each worker process of ImageFeaturizer's pool
+worker_featurizer = None
+
+def init_featurizer(feature_names):
+    ''' 
+    Pool initializer, builds this worker's featurizer with the named
+    features, since the bound feature methods cannot be pickled
+    '''
+    global worker_featurizer
+    worker_featurizer = ImageFeaturizer()
+    worker_featurizer.features_to_use = [
+        getattr(worker_featurizer, name) for name in feature_names]
+
+def featurize_with_worker(im_filename):
+    ''' features of one image, and the time spent on each feature '''
+    worker_featurizer.timings = {}
+    features = worker_featurizer.featurize(im_filename)
+    return features, worker_featurizer.timings
+
+def featurize_batch_with_worker(filenames):
+    ''' features of a batch of images, and the time spent on each feature '''
+    worker_featurizer.timings = {}
+    features = worker_featurizer.featurize_batch(filenames)
+    return features, worker_featurizer.timings
+
+
+classifier_format_version = 1
+
+def is_artifact_file(filename):
+    ''' whether filename is one of the files written by save_classifier '''
+    return (filename == 'classifier.pkl' or 
+            fnmatch.fnmatch(filename, 'classifier.pkl_*.npy'))
+
+def check_classifier_dir(classifier_dir):
+    '''
+    Raise ValueError if save_classifier would refuse to save to 
+    classifier_dir: a file, a path named like a pickle file, or a 
+    non-empty directory holding no earlier artifact
+    '''
+    classifier_dir = os.path.normpath(classifier_dir)
+    if ((os.path.exists(classifier_dir) and 
+         not os.path.isdir(classifier_dir)) or
+        os.path.splitext(classifier_dir)[1] in ['.p', '.pkl', '.pickle']):
+        raise ValueError("{} is or looks like a file, classifiers are saved "
+                         "to directories".format(classifier_dir))
+    if os.path.isdir(classifier_dir):
+        existing = os.listdir(classifier_dir)
+        if existing and 'classifier.pkl' not in existing:
+            raise ValueError("{} is not empty and holds no saved classifier, "
+                             "refusing to save over it".format(
+                             classifier_dir))
+
+def save_classifier(classifier_dir, clf, featurizer, **info):
+    '''
+    Save the classifier clf, trained on features from featurizer, to the
+    directory classifier_dir.  The classifier is saved with joblib, which
+    writes the arrays of its trees uncompressed in numpy format.  The 
+    feature names and feature signature are saved with it, along with a
+    format version and any keyword arguments in info.  
+
+    The artifact is written to a temporary directory next to 
+    classifier_dir and then moved into place, replacing only the files of
+    an earlier artifact.  Saving to a file or a path named like a pickle
+    file, or into a non-empty directory holding no earlier artifact, 
+    raises ValueError, see check_classifier_dir.
+    '''
+    check_classifier_dir(classifier_dir)
+    classifier_dir = os.path.normpath(classifier_dir)
+    artifact = {'version':classifier_format_version, 'classifier':clf,
+                'feature_names':featurizer.feature_names(),
+                'feature_signature':featurizer.feature_signature()}
+    artifact.update(info)
+    parent, name = os.path.split(os.path.abspath(classifier_dir))
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    temp_dir = tempfile.mkdtemp(prefix='.{}.'.format(name), dir=parent)
+    try:
+        joblib.dump(artifact, os.path.join(temp_dir, 'classifier.pkl'))
+        if not os.path.isdir(classifier_dir):
+            os.rename(temp_dir, classifier_dir)
+            return
+        for filename in os.listdir(classifier_dir):
+            if is_artifact_file(filename):
+                os.remove(os.path.join(classifier_dir, filename))
+        # the pickle last, so that it never refers to missing arrays
+        for filename in sorted(os.listdir(temp_dir), 
+                               key=lambda filename: filename == 
+                                                    'classifier.pkl'):
+            os.rename(os.path.join(temp_dir, filename), 
+                      os.path.join(classifier_dir, filename))
+    finally:
+        if os.path.isdir(temp_dir):
+            shutil.rmtree(temp_dir)
+
+def load_classifier(classifier_path, mmap_mode=None, featurizer=None):
+    '''
+    Load a classifier saved by save_classifier, returning the artifact 
+    dict with keys 'version', 'classifier', 'feature_names' and 
+    'feature_signature'.  mmap_mode is passed to joblib.load.  The trees 
+    of a forest copy their arrays when they are unpickled, so memory 
+    mapping does not share them between processes, and by default the 
+    arrays are read into memory.  A plain pickled classifier file, as saved
+    by earlier versions, is also accepted, with no feature names or 
+    signature.  If a featurizer is given, the classifier must have been 
+    trained on its features.
+    '''
+    if not os.path.isdir(classifier_path):
+        with open(classifier_path, 'rb') as classifier_file:
+            return {'version':0, 'classifier':pickle.load(classifier_file),
+                    'feature_names':None, 'feature_signature':None}
+    artifact = joblib.load(os.path.join(classifier_path, 'classifier.pkl'), 
+                           mmap_mode=mmap_mode)
+    if artifact['version'] != classifier_format_version:
+        raise ValueError("classifier {} has format version {}, expected {}; "
+                         "it must be retrained".format(classifier_path, 
+                         artifact['version'], classifier_format_version))
+    if (featurizer is not None and 
+        artifact['feature_signature'] != featurizer.feature_signature()):
+        raise ValueError("classifier {} was trained on different features "
+                         "than the current ones, it must be "
+                         "retrained".format(classifier_path))
+    return artifact
+
+
+def init_fold_worker(features, categories):
+    ''' Pool initializer, gives each worker the data to cross-validate '''
+    global fold_data
+    fold_data = features, categories
+
+def score_fold(task):
+    ''' fit a forest on one fold's training set, score it on its test set '''
+    fold, train, test = task
+    features, categories = fold_data
+    clf = RandomForestClassifier()
+    clf.fit(features[train], categories[train])
+    return fold, clf.score(features[test], categories[test])
+
+def cross_validate(features, categories, folds=20, n_jobs=-1, seed=0):
+    '''
+    Accuracy of a random forest on each of folds shuffled cross-validation
+    folds, with the folds fit in parallel over n_jobs processes.  Each 
+    fold's score is printed as it finishes.  The folds are shuffled with 
+    the given seed, so that they are the same on every run.
+    '''
+    if n_jobs == -1:
+        n_jobs = cpu_count()
+    cv_splits = cval.KFold(len(categories), folds, shuffle=True, 
+                           random_state=seed)
+    tasks = [(fold, train, test) 
+             for fold, (train, test) in enumerate(cv_splits)]
+    scores = np.zeros(len(tasks))
+    start = time.time()
+    workers = Pool(n_jobs, initializer=init_fold_worker, 
+                   initargs=(features, categories))
+    try:
+        for done, (fold, score) in enumerate(
+                                workers.imap_unordered(score_fold, tasks)):
+            scores[fold] = score
+            print ("cross-validation fold {}/{}: accuracy {:.3f}, "
+                   "{:.1f} sec".format(done + 1, len(tasks), score, 
+                                       time.time() - start))
+            sys.stdout.flush()
+        workers.close()
+        workers.join()
+    finally:
+        workers.terminate()
+    return scores
+
+def training_set_signature(manifest, featurizer, folds, seed):
+    '''
+    Hash of each training image's path, category, modification time and 
+    size in the ImageManifest manifest, and of the features and 
+    cross-validation folds, which changes whenever the cross-validation 
+    scores would
+    '''
+    signature = hashlib.sha1(featurizer.feature_signature())
+    signature.update("{} {}".format(folds, seed))
+    for entry in zip(manifest.paths, manifest.labels, manifest.mtimes, 
+                     manifest.sizes):
+        signature.update("{}\0{}\0{}\0{}\0".format(*entry))
+    return signature.hexdigest()
+
+
+def scan_files(directory):
+    '''
+    Generate (name, path, is_dir, stat) for each entry of directory that
+    is not hidden, with stat None for directories.  Uses scandir, from the
+    os module or the scandir package, if available, which avoids a stat 
+    call per entry to tell files from directories, and otherwise 
+    os.listdir and one stat per entry.
+    '''
+    if scandir is not None:
+        for entry in scandir(directory):
+            if entry.name[0] == '.':
+                continue
+            if entry.is_dir():
+                yield entry.name, entry.path, True, None
+            elif entry.is_file():
+                yield entry.name, entry.path, False, entry.stat()
+    else:
+        for name in os.listdir(directory):
+            if name[0] == '.':
+                continue
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            if S_ISDIR(stat.st_mode):
+                yield name, path, True, None
+            elif S_ISREG(stat.st_mode):
+                yield name, path, False, stat
+
+
+class ImageManifest(object):
+    '''
+    List of image files with the label, size and modification time of 
+    each, in order of path, which can be saved, loaded and compared to 
+    find the images added, removed or changed between two scans.
+
+    Arguments:
+    ---------------
+    paths, labels, sizes, mtimes - sequences with one entry per image
+    '''
+    def __init__(self, paths=[], labels=[], sizes=[], mtimes=[]):
+        self.paths = list(paths)
+        self.labels = list(labels)
+        self.sizes = list(sizes)
+        self.mtimes = list(mtimes)
+
+    @classmethod
+    def scan(cls, directory, labeled=True, recursive=False, pattern=None):
+        '''
+        Scan directory for images.  If labeled, images are taken from the
+        subdirectories of directory, labeled by subdirectory name, as in 
+        prepare_training_set, otherwise from directory itself with empty
+        labels.  With recursive, images in all deeper subdirectories are
+        included, with the label of their top subdirectory.  If a pattern 
+        is given, only files whose names match it, as in fnmatch, are 
+        included.  Hidden files and directories are skipped.
+        '''
+        if labeled:
+            roots = [(name, path) for name, path, is_dir, stat in 
+                     scan_files(directory) if is_dir]
+        else:
+            roots = [('', directory)]
+        entries = []
+        for label, root in roots:
+            to_scan = [root]
+            while to_scan:
+                for name, path, is_dir, stat in scan_files(to_scan.pop()):
+                    if is_dir:
+                        if recursive:
+                            to_scan.append(path)
+                    elif pattern is None or fnmatch.fnmatch(name, pattern):
+                        entries.append((path, label, stat.st_size, 
+                                        stat.st_mtime))
+        entries.sort()
+        return cls(*zip(*entries)) if entries else cls()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def save(self, filename):
+        ''' save the manifest to the numpy .npz file filename '''
+        np.savez(filename, paths=np.array(self.paths, dtype=str), 
+                 labels=np.array(self.labels, dtype=str), 
+                 sizes=np.array(self.sizes, dtype=np.int64), 
+                 mtimes=np.array(self.mtimes, dtype=float))
+
+    @classmethod
+    def load(cls, filename):
+        saved = np.load(filename)
+        return cls(saved['paths'].tolist(), saved['labels'].tolist(),
+                   saved['sizes'].tolist(), saved['mtimes'].tolist())
+
+    def diff(self, previous):
+        '''
+        Compare to an earlier manifest, returns a tuple of lists of the 
+        paths (added, removed, changed), where changed images have a new 
+        label, size or modification time
+        '''
+        old = dict(zip(previous.paths, zip(previous.labels, previous.sizes, 
+                                           previous.mtimes)))
+        new = dict(zip(self.paths, zip(self.labels, self.sizes, 
+                                       self.mtimes)))
+        added = [path for path in self.paths if path not in old]
+        removed = [path for path in previous.paths if path not in new]
+        changed = [path for path in self.paths 
+                   if path in old and old[path] != new[path]]
+        return added, removed, changed
+
+
+def read_image(im_filename):
+    return imread(im_filename).astype(float)
+
+def iter_images(filenames, threads=2, prefetch=8):
+    '''
+    Generate (filename, image array) for each of filenames, in order, 
+    with up to prefetch images decoded ahead on a pool of threads, so 
+    that reading and decoding images overlaps with processing them.  The
+    image decoders release the GIL, so this works with threads.  With 
+    threads=0 each image is read when it is requested.
+    '''
+    if threads == 0:
+        for im_filename in filenames:
+            yield im_filename, read_image(im_filename)
+        return
+    filenames = iter(filenames)
+    readers = ThreadPool(threads)
+    try:
+        pending = deque((im_filename, 
+                         readers.apply_async(read_image, (im_filename,)))
+                        for im_filename in islice(filenames, prefetch))
+        while pending:
+            im_filename, image = pending.popleft()
+            for next_filename in islice(filenames, 1):
+                pending.append((next_filename, readers.apply_async(
+                                read_image, (next_filename,))))
+            yield im_filename, image.get()
+    finally:
+        readers.terminate()
 
 def prepare_training_set(training_dir):
     '''
@@ -176,42 +974,56 @@ def prepare_training_set(training_dir):
             ...
     The names of categories will be taken from the name of their 
     subdirectory, and all images in that subdir are assigned to the 
-    corresponding category.  
+    corresponding category.  Directories are scanned, and hidden files 
+    skipped, by ImageManifest.scan.
 
     Output:
     a tuple (image_files, categories)
     image_files - list of all training image filenames
     categories - list of the category of each training image, respectively
     '''
-    if training_dir[-1] == '/':
-        training_dir = training_dir[:-1]
-    cat_names = [d for d in os.listdir(training_dir)
-                    if os.path.isdir(training_dir + '/' + d)]
-    cat_dirs = [training_dir + '/' + catagory for catagory in cat_names]
-    categories = []
-    image_files = []
-    for cat_name, cat_dir in zip(cat_names, cat_dirs):
-        images = [cat_dir + '/' + f for f in os.listdir(cat_dir) 
-                                    if (os.path.isfile(cat_dir + '/' + f) and
-                                        f[0] != '.')]
-        categories += [cat_name]*len(images)
-        image_files += images
-    return image_files, np.array(categories)
+    manifest = ImageManifest.scan(training_dir)
+    return manifest.paths, np.array(manifest.labels)
 
 def construct_classifier(training_dir, folds=20, 
-                         classifier_file='trained_classifier.p'):
+                         classifier_file='trained_classifier',
+                         n_jobs=-1, feature_cache='image_features.db',
+                         memmap_file=None, batch_size=None, seed=0,
+                         warm_start=False, add_trees=10):
     '''
     Construct a random forest image classifier from the training data in 
     the passed directory.  The directory must be formated as described 
     in the function "prepare_training_set".  The final classifier will be 
-    pickled as well as returned.
+    saved with save_classifier as well as returned.
 
     Arguments:
     training_dir - directory of training data, for formating specifications
     see "prepare_training_set"
     folds - number of folds of cross_validation to preform, default is 20
-    classifier_file - file destination for pickled final classifier, default
-    is 'trained_classifier.p'
+    classifier_file - destination directory for the final classifier, see
+    save_classifier, default is 'trained_classifier'.  It is checked before
+    any work is done, and a ValueError is raised if it cannot be saved to.
+    n_jobs - number of processes used to featurize images, default is -1,
+    one per core
+    feature_cache - sqlite file of cached image features, so that only new
+    or changed images are featurized, default is 'image_features.db'.  
+    None disables the cache.
+    memmap_file - if given, features are streamed to a memmap in this file,
+    which is passed to the classifier without copying, for training sets 
+    too large for memory
+    batch_size - if given, images are featurized in batches of this size,
+    with equal size images featurized together as one stack
+    seed - seed for shuffling the cross-validation folds, default is 0
+    warm_start - if True, and the classifier already saved to 
+    classifier_file was trained on the same categories, keep its trees 
+    and fit add_trees more on the full training set, rather than fitting 
+    a new forest of 50 trees.  Default is False.
+    add_trees - number of trees added when warm starting, default is 10
+
+    The cross-validation folds are fit in parallel over n_jobs processes.
+    Their scores are saved with the classifier, and reused without 
+    refitting the folds if neither the training images nor the features 
+    have changed since.
 
     Output:
     tuple (clf, accuracy)
@@ -219,27 +1031,64 @@ def construct_classifier(training_dir, folds=20,
     accuracy - median accuracy of classifier via cross validation
     '''
     initial_time = time.time()
+    check_classifier_dir(classifier_file)
     # get data, compute features
-    image_files, categories = prepare_training_set(training_dir)
-    featurizer = ImageFeaturizer(images=image_files)
+    manifest = ImageManifest.scan(training_dir)
+    image_files, categories = manifest.paths, np.array(manifest.labels)
+    featurizer = ImageFeaturizer(images=image_files, n_jobs=n_jobs, 
+                                 cache_file=feature_cache, 
+                                 memmap_file=memmap_file, 
+                                 batch_size=batch_size)
     features = featurizer.get_features()
     feature_names = np.array(featurizer.feature_names())
-    # shuffle and estimate accuracy with cross validation
-    shuffle_index = np.arange(features.shape[0])
-    npshuffle(shuffle_index)
-    features = features[shuffle_index, :]
-    categories = categories[shuffle_index, :]
-    cv_splits = cval.KFold(len(categories), folds, shuffle=True)
-    cv_scores = cval.cross_val_score(RandomForestClassifier(), features, 
-                                     categories, cv=cv_splits, n_jobs=-1)
+    previous = None
+    if os.path.exists(classifier_file):
+        try:
+            previous = load_classifier(classifier_file, featurizer=featurizer)
+        except ValueError as error:
+            print "not reusing previous classifier: {}".format(error)
+    # estimate accuracy with cross validation, the folds are shuffled so 
+    # the features need not be, which would copy them
+    training_set = training_set_signature(manifest, featurizer, folds, seed)
+    if previous is not None and 'manifest' in previous:
+        added, removed, changed = manifest.diff(ImageManifest(
+                                                    *previous['manifest']))
+        print ("since the last build: {} images added, {} removed, {} "
+               "changed".format(len(added), len(removed), len(changed)))
+    if (previous is not None and 
+        previous.get('training_set_signature') == training_set):
+        print "training set unchanged, reusing cross-validation scores"
+        cv_scores = previous['cv_scores']
+    else:
+        cv_scores = cross_validate(features, categories, folds=folds, 
+                                   n_jobs=n_jobs, seed=seed)
     accuracy = np.median(cv_scores)
     random_guessing = 1.0/len(np.unique(categories))
     # build classifier on full training set
-    full_classifier = RandomForestClassifier(n_estimators=50, n_jobs=-1, 
-                                             compute_importances=True)
+    full_classifier = None
+    if warm_start and previous is not None:
+        full_classifier = previous['classifier']
+        if 'warm_start' not in full_classifier.get_params():
+            print ("cannot warm start, this version of sklearn does not "
+                   "support it; refitting")
+            full_classifier = None
+        elif list(full_classifier.classes_) != list(np.unique(categories)):
+            print "cannot warm start, the categories have changed; refitting"
+            full_classifier = None
+        else:
+            full_classifier.set_params(warm_start=True, n_estimators=
+                                       full_classifier.n_estimators + 
+                                       add_trees)
+    if full_classifier is None:
+        # feature_importances_ is always computed, compute_importances was
+        # removed in the same sklearn release that added warm_start
+        full_classifier = RandomForestClassifier(n_estimators=50, n_jobs=-1)
     full_classifier.fit(features, categories)
     # output stats and save full classifier
-    pickle.dump(full_classifier, open(classifier_file,'w'))
+    save_classifier(classifier_file, full_classifier, featurizer, 
+                    cv_scores=cv_scores, training_set_signature=training_set,
+                    manifest=(manifest.paths, manifest.labels, 
+                              manifest.sizes, manifest.mtimes))
     final_time = time.time()
     print ("\nbuilt random forest classifier in {:.1f} sec, "
            "saved to: {}".format(final_time - initial_time, classifier_file))
@@ -258,19 +1107,24 @@ def construct_classifier(training_dir, folds=20,
         print "{}\t{}\t{:.3f}".format(n+1 ,feature_name, importance)
     return full_classifier, accuracy
 
-def run_final_classifier(path, forest='trained_classifier.p', 
-                         print_results=True):
+def run_final_classifier(path, forest='trained_classifier', 
+                         print_results=True, n_jobs=-1, 
+                         feature_cache='image_features.db', memmap_file=None,
+                         batch_size=None):
     '''
     Use classifier saved in the file forest to identify each in in the 
-    directory path, results are printed to screen if print_results is True
-    '''
-    clf = pickle.load(open(forest, "rb"))
-    if path[-1] == '/':
-        path = path[:-1]
-    images = [path + '/' + f for f in os.listdir(path) 
-                             if (os.path.isfile(path + '/' + f) and
-                                 f[0] != '.')]
-    featurizer = ImageFeaturizer(images=images)
+    directory path, results are printed to screen if print_results is True.
+    Images are featurized over n_jobs processes, using the feature cache 
+    file feature_cache, streaming to memmap_file and in batches of 
+    batch_size as in construct_classifier.  forest is loaded with 
+    load_classifier, and must have been trained on the current features.
+    '''
+    clf = load_classifier(forest, featurizer=ImageFeaturizer())['classifier']
+    images = ImageManifest.scan(path, labeled=False).paths
+    featurizer = ImageFeaturizer(images=images, n_jobs=n_jobs, 
+                                 cache_file=feature_cache, 
+                                 memmap_file=memmap_file, 
+                                 batch_size=batch_size)
     features = featurizer.get_features()
     feature_names = np.array(featurizer.feature_names())
     results = clf.predict(features)
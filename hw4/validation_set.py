@@ -1,6 +1,6 @@
 '''
 This script will test the image classifier built in 'image_classifier.py'
-and saved to 'trained_classifier.p' on the provided set of validation images.
+and saved to 'trained_classifier' on the provided set of validation images.
 This classifier was previously trained on the images provided with the
 original homework.  
 '''
@@ -0,0 +1,86 @@
+"""
+Benchmark processing a list of images through a pipeline of methods on a
+running ImageServer: with one blocking request per image and method, with
+one process_batch request, streamed with start_batch and batch_results,
+and with many single method requests in flight from an AsyncImageClient.
+The time until the first new image is received is also shown.  Each mode
+returns the new images and the time the first of them was received.
+"""
+
+import time
+import argparse
+import xmlrpclib
+
+import numpy as np
+
+from image_transport import encode_image, decode_image
+from batch_client import AsyncImageClient, process_batch, stream_batch
+
+def one_by_one(url, images, pipeline, in_flight):
+    server = xmlrpclib.ServerProxy(url)
+    new_images, first = [], None
+    for image in images:
+        for method in pipeline:
+            image = decode_image(getattr(server, method)(encode_image(image)))
+        new_images.append(image)
+        first = first or time.time()
+    return new_images, first
+
+def batched(url, images, pipeline, in_flight):
+    new_images = process_batch(xmlrpclib.ServerProxy(url), images, pipeline)
+    return new_images, time.time()
+
+def streamed(url, images, pipeline, in_flight):
+    new_images, first = [None]*len(images), None
+    for index, new_image in stream_batch(xmlrpclib.ServerProxy(url), images,
+                                         pipeline):
+        new_images[index] = new_image
+        first = first or time.time()
+    return new_images, first
+
+def asynchronous(url, images, pipeline, in_flight):
+    client = AsyncImageClient(url, in_flight)
+    for method in pipeline[:-1]:
+        images = list(client.map(method, images))
+    new_images, first = [], None
+    for new_image in client.map(pipeline[-1], images):
+        new_images.append(new_image)
+        first = first or time.time()
+    client.close()
+    return new_images, first
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark batch and "
+                                     "asynchronous image requests")
+    parser.add_argument("--host", type=str, default="localhost")
+    parser.add_argument("--port", type=int, default=5009)
+    parser.add_argument("--images", type=int, default=64,
+                        help="number of images to process")
+    parser.add_argument("--size", type=int, default=64,
+                        help="side length of the square rgb test images")
+    parser.add_argument("--pipeline", type=str, nargs="+",
+                        default=["invert", "colorize_by_power"])
+    parser.add_argument("--in-flight", type=int, default=8, dest="in_flight",
+                        help="requests in flight for the async client")
+    args = parser.parse_args()
+    url = "http://{}:{}".format(args.host, args.port)
+    images = [np.random.randint(0, 256, (args.size, args.size, 3)
+                                ).astype(np.uint8)
+              for image in range(args.images)]
+    print "{} {}x{} images through {}".format(args.images, args.size,
+                                              args.size,
+                                              " -> ".join(args.pipeline))
+    print "{:<14}{:>12}{:>12}{:>14}{:>10}".format("mode", "first (sec)",
+        "total (sec)", "images/sec", "speedup")
+    expected = None
+    for mode in [one_by_one, batched, streamed, asynchronous]:
+        start = time.time()
+        new_images, first = mode(url, images, args.pipeline, args.in_flight)
+        elapsed = time.time() - start
+        if expected is None:
+            expected, base_time = new_images, elapsed
+        assert all(np.array_equal(new_image, image) for new_image, image
+                   in zip(new_images, expected))
+        print "{:<14}{:>12.3f}{:>12.3f}{:>14.1f}{:>10.2f}".format(
+            mode.__name__, first - start, elapsed, len(images)/elapsed,
+            base_time/elapsed)
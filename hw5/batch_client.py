@@ -0,0 +1,88 @@
+"""
+Clients for processing many images with an ImageServer.  stream_batch
+sends a list of images and a pipeline of method names in one request, and
+yields the new images as the server finishes them, fetching those done
+since the last fetch in each round trip.  AsyncImageClient instead keeps
+many single image requests in flight at once, each on its own connection.
+"""
+
+import threading
+import xmlrpclib
+from multiprocessing.pool import ThreadPool
+
+from image_transport import encode_image, decode_image
+
+
+def stream_batch(server, images, pipeline, max_wait=1.0):
+    """
+    Run the arrays images through the methods named in pipeline on the
+    ImageServer proxy server, yielding (index, new image) pairs as they
+    finish, where index is the position of the image in images.  Each
+    fetch waits up to max_wait seconds on the server for new results.  If
+    an image fails, the images finished before it are yielded and then 
+    RuntimeError is raised.  If the iteration is stopped early, the batch
+    is cancelled on the server.
+    """
+    job_id = server.start_batch([encode_image(image) for image in images],
+                                pipeline)
+    done = False
+    try:
+        while not done:
+            fetched = server.batch_results(job_id, max_wait)
+            for index, new_image in fetched['results']:
+                yield index, decode_image(new_image)
+            if 'error' in fetched:
+                raise RuntimeError("batch {} failed: {}".format(job_id, 
+                                   fetched['error']))
+            done = fetched['done']
+    finally:
+        if not done:
+            try:
+                server.cancel_batch(job_id)
+            except (xmlrpclib.Error, IOError):
+                pass
+
+def process_batch(server, images, pipeline):
+    """ list of the arrays images run through pipeline, in one request """
+    return [decode_image(new_image) for new_image in
+            server.process_batch([encode_image(image) for image in images],
+                                 pipeline)]
+
+
+class AsyncImageClient(object):
+    """
+    Sends image method requests to the ImageServer at url from a pool of
+    in_flight threads, each with its own connection, so that up to
+    in_flight requests are waiting on the server at once.  Requests are
+    made with submit, which returns an AsyncResult, or with map.  The
+    concurrent server, run with workers, handles them in parallel.
+    """
+    def __init__(self, url, in_flight=8):
+        self.url = url
+        self.local = threading.local()
+        self.pool = ThreadPool(in_flight)
+
+    def proxy(self):
+        """ the connection of the calling thread """
+        if not hasattr(self.local, 'server'):
+            self.local.server = xmlrpclib.ServerProxy(self.url)
+        return self.local.server
+
+    def call(self, method, image):
+        return decode_image(getattr(self.proxy(), method)(
+                            encode_image(image)))
+
+    def submit(self, method, image):
+        """ AsyncResult whose get returns the array image after method """
+        return self.pool.apply_async(self.call, (method, image))
+
+    def map(self, method, images):
+        """
+        Iterator over the arrays images after method, in order, with up to
+        in_flight of them requested at once
+        """
+        return self.pool.imap(lambda image: self.call(method, image), images)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,99 @@
+"""
+Benchmark the ImageMethods frequency routines against the original
+per-channel complex fft2 versions, checking that their results agree.
+Images are not archived.
+"""
+
+import os
+import sys
+import imp
+import time
+import argparse
+
+import numpy as np
+from scipy.fftpack import fft2, ifft2, fftshift
+
+server_module = imp.load_source("image_server", os.path.join(
+                    os.path.dirname(os.path.abspath(__file__)),
+                    "image-server.py"))
+
+def original_frequency_space_by_channel(image):
+    if len(image.shape) == 3:
+        freq_space = np.zeros(image.shape)
+        for color in [0,1,2]:
+            freq_space[..., color] = fftshift(fft2(image[..., color])).real
+    else:
+        freq_space = fftshift(fft2(image))
+    return freq_space.real
+
+def original_colorize_by_power(image):
+    if len(image.shape) == 3:
+        power = fft2(np.sum(image, axis=2))**2
+    else:
+        power = fft2(image)**2
+    thirds = (power.max() - power.min())/3.0
+    third_cut = power.min() + thirds
+    twothird_cut = third_cut + thirds
+    lower = power < third_cut
+    upper = power > twothird_cut
+    middle = ~(lower | upper)
+    colorized = np.zeros((power.shape[0], power.shape[1], 3),
+                         dtype=np.uint8)
+    for color, region in enumerate([upper, middle, lower]):
+        new_channel = ifft2(np.where(region, power, 0.0))
+        shifted = (new_channel - new_channel.min())
+        scaled = 255.0*shifted/shifted.max()
+        colorized[..., color] = ifft2(np.where(region, power, 0.0)).real
+    return colorized
+
+def best_time(method, image, trials):
+    """ best time of method(image) over trials, hiding what it prints """
+    times = []
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    try:
+        for trial in range(trials):
+            start = time.time()
+            result = method(image)
+            times.append(time.time() - start)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return min(times), result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the frequency "
+                                     "space image methods")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[128, 256, 512, 1024],
+                        help="side lengths of the square test images")
+    parser.add_argument("--trials", type=int, default=5,
+                        help="timing trials, the best is shown")
+    args = parser.parse_args()
+    methods = server_module.ImageMethods(archive='off')
+    print "{:<28}{:>6}{:>12}{:>16}{:>16}{:>10}{:>12}".format("method",
+        "image", "size", "original (/s)", "current (/s)", "speedup",
+        "max diff")
+    for name, original in [
+            ("frequency_space_by_channel",
+             original_frequency_space_by_channel),
+            ("colorize_by_power", original_colorize_by_power)]:
+        # the undecorated method, without transport or archiving
+        current = lambda image: getattr(methods, name).image_method(methods,
+                                                                     image)
+        for size in args.sizes:
+            for kind, shape in [("rgb", (size, size, 3)),
+                                ("gray", (size, size))]:
+                image = np.random.randint(0, 256, shape).astype(np.uint8)
+                original_time, expected = best_time(original, image,
+                                                    args.trials)
+                current_time, result = best_time(current, image, args.trials)
+                if result.dtype == np.uint8:
+                    difference = np.sum(result != expected)
+                else:
+                    difference = (np.abs(result - expected).max()/
+                                  np.abs(expected).max())
+                print ("{:<28}{:>6}{:>12}{:>16.1f}{:>16.1f}{:>10.2f}"
+                       "{:>12.3g}".format(name, kind,
+                       "{0}x{0}".format(size), 1/original_time,
+                       1/current_time, original_time/current_time,
+                       difference))
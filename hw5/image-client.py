@@ -4,13 +4,17 @@ import os
 
 from scipy.ndimage import imread 
 
-# read rgb and gray images, convert to list form 
+from image_transport import encode_image, decode_image
+from batch_client import AsyncImageClient, stream_batch
+
+# read rgb and gray images, encode as binary for transport
 examples_dir = "example-images"
 image_filenames = os.listdir(examples_dir)
 half = int(len(image_filenames)/2)
-rgb_images = [imread("{}/{}".format(examples_dir, image)).tolist() 
+rgb_images = [encode_image(imread("{}/{}".format(examples_dir, image)))
 					for image in image_filenames]
-gray_images = [imread("{}/{}".format(examples_dir, image), flatten=True).tolist() 
+gray_images = [encode_image(imread("{}/{}".format(examples_dir, image), 
+								   flatten=True)) 
 					for image in image_filenames]
 
 # connect to server
@@ -23,4 +27,22 @@ im2 = server.colorize_by_power(rgb_images[0])
 im3 = server.invert(gray_images[1])
 im4 = server.invert(rgb_images[1])
 im5 = server.frequency_space_by_channel(gray_images[2])
-im6 = server.frequency_space_by_channel(rgb_images[2])
\ No newline at end of file
+im6 = server.frequency_space_by_channel(rgb_images[2])
+im1, im2, im3, im4, im5, im6 = [decode_image(im) for im in 
+								[im1, im2, im3, im4, im5, im6]]
+
+# run all the rgb images through a pipeline in one request, then again
+# receiving each image as the server finishes it
+pipeline = ["invert", "colorize_by_power"]
+batch = server.process_batch(rgb_images, pipeline)
+batch = [decode_image(im) for im in batch]
+streamed = [None]*len(rgb_images)
+for index, im in stream_batch(server, [decode_image(im) for im in rgb_images],
+							  pipeline):
+	streamed[index] = im
+
+# invert the gray images with many requests in flight at once
+client = AsyncImageClient("http://%s:%d" % (host, port), in_flight=8)
+inverted = list(client.map("invert", 
+						   [decode_image(im) for im in gray_images]))
+client.close()
@@ -1,35 +1,333 @@
 import os
+import time
+import Queue
+import signal
+import argparse
+import threading
+import itertools
+from collections import deque
+from multiprocessing import Pool
 from SimpleXMLRPCServer import SimpleXMLRPCServer
 
 import numpy as np
-from scipy.fftpack import fft2, ifft2, fftshift
+from scipy.fftpack import ifft2, fftshift
 from scipy.misc import imsave
 
+from image_transport import encode_image, decode_image, is_encoded
 
-def list_and_record(image_method):
-    def wrapped(self, image):
-        print "running image method..."
-        image_dir = "server-images"
-        image = np.array(image)
+
+class ImageArchive(object):
+    """
+    Saves the input and output images of requests to image_dir, as
+    image_N.png and new_image_N.png, on a background thread so that
+    encoding and writing the PNGs is not part of the request.  N is taken 
+    from a counter seeded once, from the images already in image_dir.  
+    At most queue_size pairs wait to be written; beyond that, pairs are 
+    dropped and counted rather than delaying requests.  Pairs that fail to
+    be written are counted in failed, and the writer carries on.  Images
+    may be recorded as sent over XML-RPC, and are then decoded on the 
+    writer thread, only if they are kept.
+
+    Arguments:
+    ---------------
+    image_dir - directory for the archived images
+    mode - 'on' archives every request, 'sampled' every sample_every-th
+        request, and 'off' none
+    sample_every - archive one of this many requests in 'sampled' mode
+    queue_size - most image pairs waiting to be written
+    """
+    def __init__(self, image_dir="server-images", mode='on', sample_every=10,
+                 queue_size=64):
+        if mode not in ['on', 'sampled', 'off']:
+            raise ValueError("Invalid archive mode: {}".format(mode))
+        self.image_dir = image_dir
+        self.mode = mode
+        self.sample_every = sample_every
+        self.requests = itertools.count()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+        if mode == 'off':
+            return
         previous_image_nums = [int(f[6:-4]) for f in os.listdir(image_dir) 
                                                   if (f[:6] == 'image_' and 
                                                       f[-4:] == '.png')]
-        if previous_image_nums:
-            image_num = max(previous_image_nums) + 1
-        else:
-            image_num = 0
-        imsave("{}/image_{}.png".format(image_dir, image_num), image)
+        self.image_nums = itertools.count(max(previous_image_nums + [-1]) + 1)
+        self.queue = Queue.Queue(queue_size)
+        self.writer = threading.Thread(target=self.write_images)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def record(self, image, new_image):
+        """ 
+        queue an input and output image pair to be saved, each an array or
+        an image as sent over XML-RPC
+        """
+        if self.mode == 'off':
+            return
+        with self.lock:
+            if (self.mode == 'sampled' and 
+                next(self.requests) % self.sample_every != 0):
+                return
+            image_num = next(self.image_nums)
+        try:
+            self.queue.put_nowait((image_num, image, new_image))
+        except Queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def write_images(self):
+        while True:
+            queued = self.queue.get()
+            if queued is None:
+                break
+            image_num, image, new_image = queued
+            try:
+                image, new_image = [
+                    image if isinstance(image, np.ndarray) else 
+                    decode_image(image) for image in [image, new_image]]
+                imsave("{}/image_{}.png".format(self.image_dir, image_num), 
+                       image)
+                imsave("{}/new_image_{}.png".format(self.image_dir, 
+                                                    image_num), new_image)
+            except Exception as error:
+                print "failed to archive image {}: {}".format(image_num, 
+                                                              error)
+                with self.lock:
+                    self.failed += 1
+            else:
+                with self.lock:
+                    self.written += 1
+
+    def close(self, timeout=10.0):
+        """ 
+        write the images still queued, then stop the writer thread, giving
+        up after timeout seconds
+        """
+        if self.mode != 'off' and self.writer.is_alive():
+            try:
+                self.queue.put(None, timeout=timeout)
+            except Queue.Full:
+                return
+            self.writer.join(timeout)
+
+
+def real_fft2(image, real_part=False):
+    """
+    Full 2d Fourier transform over the last two axes of a real array, as 
+    fft2 would compute it, or only its real part if real_part is True.  
+    Only half of the modes are computed, with a real-input fft, and the 
+    rest filled in by the symmetry of transforms of real data, 
+    X[-k1, -k2] = conj(X[k1, k2]).  numpy caches the fft twiddle factors 
+    for each transform length, so repeated image shapes reuse them.
+    """
+    width = image.shape[-1]
+    half = np.fft.rfftn(image, axes=(-2, -1))
+    if real_part:
+        half = half.real
+    n = half.shape[-1]
+    full = np.empty(image.shape, dtype=half.dtype)
+    full[..., :n] = half
+    full[..., 0, n:] = half[..., 0, width - n:0:-1].conj()
+    full[..., 1:, n:] = half[..., :0:-1, width - n:0:-1].conj()
+    return full
+
+def list_and_record(image_method):
+    """
+    Wrap an image method to take and return images sent over XML-RPC, 
+    either as nested lists or binary encoded by image_transport, replying
+    in the same form.  Binary images are passed to the method as read-only
+    arrays, so methods must not modify their input.  Each input and output
+    image is recorded in the ImageArchive of the ImageMethods instance.
+    """
+    def wrapped(self, image):
+        print "running image method..."
+        binary = is_encoded(image)
+        image = decode_image(image)
         new_image = image_method(self, image)
-        imsave("{}/new_image_{}.png".format(image_dir, image_num), new_image)
+        self.archive.record(image, new_image)
+        if binary:
+            return encode_image(new_image)
         return new_image.tolist()
+    wrapped.image_method = image_method
     return wrapped
 
 
+class BatchJob(object):
+    """
+    Results of a batch started by ImageMethods.start_batch, queued as
+    (index, image) pairs as each image finishes, until they are taken.  
+    An error stops the batch, and is queued after the results before it.
+    polled is the time the job was started or its results last taken, 
+    and once cancelled is set no more results are queued.
+    """
+    def __init__(self, size):
+        self.remaining = size
+        self.results = Queue.Queue()
+        self.polled = time.time()
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def run(self, results):
+        """ queue the pairs of the iterator results, or the error it raises """
+        try:
+            for result in results:
+                if self.cancelled:
+                    break
+                self.results.put(result)
+        except Exception as error:
+            self.results.put(error)
+
+    def take(self, max_wait):
+        """ 
+        Results queued since the last call, waiting up to max_wait seconds
+        for the first of them.  Returns the list of results, the error 
+        that stopped the batch or None, and whether the job is done, 
+        either with all of its results or an error taken.
+        """
+        with self.lock:
+            self.polled = time.time()
+            taken = []
+            try:
+                if self.remaining > 0:
+                    taken.append(self.results.get(timeout=max_wait))
+                while True:
+                    taken.append(self.results.get_nowait())
+            except Queue.Empty:
+                pass
+            error = None
+            if taken and isinstance(taken[-1], Exception):
+                error = taken.pop()
+                self.remaining = 0
+            else:
+                self.remaining -= len(taken)
+            return taken, error, self.remaining == 0
+
+
 class ImageMethods(object):
-    """ A bucket of image manipulation routines """
+    """
+    A bucket of image manipulation routines.  The images of each call are
+    archived to save_dir, depending on archive and sample_every, see
+    ImageArchive.  Lists of images can be run through a pipeline of 
+    methods in one request with process_batch, or with start_batch and 
+    batch_results to receive each image as it finishes.  Batches are run
+    by map_pipeline(images, pipeline), which yields (index, new image) 
+    pairs as each image finishes, and by default runs the images one 
+    after another in this process.  Batch jobs whose results have not 
+    been fetched for job_ttl seconds are cancelled and forgotten, as are 
+    jobs passed to cancel_batch.
+    """
 
-    def __init__(self, save_dir="server_images"):
+    def __init__(self, save_dir="server-images", archive='on', 
+                 sample_every=10, map_pipeline=None, job_ttl=300.0):
         self.save_dir = save_dir
+        self.archive = ImageArchive(save_dir, mode=archive, 
+                                    sample_every=sample_every)
+        # private, so that it is not served over XML-RPC
+        self._map_pipeline = map_pipeline or self._apply_each
+        self._jobs = {}
+        self._job_ids = itertools.count()
+        self._jobs_lock = threading.Lock()
+        self._job_ttl = job_ttl
+
+    def _expire_jobs(self):
+        """ cancel and forget the jobs not polled within the job ttl """
+        now = time.time()
+        with self._jobs_lock:
+            for job_id, job in self._jobs.items():
+                if now - job.polled > self._job_ttl:
+                    job.cancelled = True
+                    del self._jobs[job_id]
+
+    def _apply_each(self, images, pipeline):
+        """ 
+        (index, new image) pairs of the images of the list images run 
+        through pipeline, yielded as each finishes
+        """
+        for index, image in enumerate(images):
+            yield index, apply_pipeline(self, image, pipeline)
+
+    def _run_batch(self, images, pipeline):
+        """ 
+        (index, reply) pairs of the images run through pipeline, archived 
+        and encoded as they were received, yielded as each finishes
+        """
+        decoded = [decode_image(image) for image in images]
+        for index, new_image in self._map_pipeline(decoded, pipeline):
+            self.archive.record(decoded[index], new_image)
+            if is_encoded(images[index]):
+                yield index, encode_image(new_image)
+            else:
+                yield index, new_image.tolist()
+
+    def process_batch(self, images, pipeline):
+        """
+        Run each image of the list images through the image methods named 
+        in the list pipeline, in order, and return the list of new images,
+        all in one request.  Images are replied in the form they were 
+        sent, as for the single image methods.
+        """
+        check_pipeline(pipeline)
+        new_images = [None]*len(images)
+        for index, new_image in self._run_batch(images, pipeline):
+            new_images[index] = new_image
+        return new_images
+
+    def start_batch(self, images, pipeline):
+        """
+        Start running each image of the list images through the image 
+        methods named in the list pipeline, in the background, and return
+        a job number to fetch the new images with batch_results.
+        """
+        check_pipeline(pipeline)
+        self._expire_jobs()
+        job = BatchJob(len(images))
+        with self._jobs_lock:
+            job_id = next(self._job_ids)
+            self._jobs[job_id] = job
+        runner = threading.Thread(target=job.run, 
+                                  args=(self._run_batch(images, pipeline),))
+        runner.daemon = True
+        runner.start()
+        return job_id
+
+    def batch_results(self, job_id, max_wait=1.0):
+        """
+        The new images of the batch job_id started by start_batch that 
+        finished since the last call, waiting up to max_wait seconds for 
+        at least one.  Returns a dict of 'results', a list of [index, 
+        image] pairs, where index is the position of the image in the 
+        batch, and 'done', which is True once all images are returned and
+        the job is forgotten.  If an image fails, the batch stops, and the
+        dict also has 'error', describing it, along with the results that
+        finished before it; the batch is then done.
+        """
+        self._expire_jobs()
+        with self._jobs_lock:
+            if job_id not in self._jobs:
+                raise Exception("Unknown batch job: {}".format(job_id))
+            job = self._jobs[job_id]
+        results, error, done = job.take(max_wait)
+        if done:
+            with self._jobs_lock:
+                self._jobs.pop(job_id, None)
+        reply = {'results': [list(result) for result in results], 
+                 'done': done}
+        if error is not None:
+            reply['error'] = "{}: {}".format(type(error).__name__, error)
+        return reply
+
+    def cancel_batch(self, job_id):
+        """ 
+        Stop the batch job_id started by start_batch and forget its 
+        results.  Images already being processed still finish.
+        """
+        with self._jobs_lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None:
+            job.cancelled = True
+        return job is not None
 
     @list_and_record
     def invert(self, image):
@@ -40,13 +338,12 @@ class ImageMethods(object):
         print "inverting...."
         if len(image.shape) == 3:
             maxes = np.max(np.max(image, axis=0), axis=0)
-            for channel, channel_max in enumerate(maxes):
-                image[..., channel] = channel_max - image[..., channel]
+            image = maxes - image
         elif len(image.shape) == 2:
             max_gray = np.max(image)
             image = max_gray - image
         else:
-            raise Exception("Invalid image shape: {}".foramt(image.shape))
+            raise Exception("Invalid image shape: {}".format(image.shape))
         return image
 
     @list_and_record
@@ -58,14 +355,18 @@ class ImageMethods(object):
         """
         print "converting to frequency space....."
         if len(image.shape) == 3:
+            # transform all colors at once, as contiguous planes
+            planes = np.ascontiguousarray(np.rollaxis(image[..., :3], 2), 
+                                          dtype=float)
+            planes = fftshift(real_fft2(planes, real_part=True), axes=(1, 2))
             freq_space = np.zeros(image.shape)
-            for color in [0,1,2]:
-                freq_space[..., color] = fftshift(fft2(image[..., color]))
+            freq_space[..., :3] = np.rollaxis(planes, 0, 3)
         elif len(image.shape) == 2:
-            freq_space = fftshift(fft2(image))
+            freq_space = fftshift(real_fft2(image.astype(float), 
+                                            real_part=True))
         else:
-            raise Exception("Invalid image shape: {}".foramt(image.shape))
-        return freq_space.real
+            raise Exception("Invalid image shape: {}".format(image.shape))
+        return freq_space
 
     @list_and_record
     def colorize_by_power(self, image):
@@ -77,34 +378,228 @@ class ImageMethods(object):
         """
         print "colorizing....."
         if len(image.shape) == 3:
-            power = fft2(np.sum(image, axis=2))**2
+            power = real_fft2(np.sum(image, axis=2).astype(float))**2
         elif len(image.shape) == 2:
-            power = fft2(image)**2
+            power = real_fft2(image.astype(float))**2
         else:
-            raise Exception("Invalid image shape: {}".foramt(image.shape))
-        thirds = (power.max() - power.min())/3.0
-        third_cut = power.min() + thirds
+            raise Exception("Invalid image shape: {}".format(image.shape))
+        power_min = power.min()
+        thirds = (power.max() - power_min)/3.0
+        third_cut = power_min + thirds
         twothird_cut = third_cut + thirds
         lower = power < third_cut
         upper = power > twothird_cut
         middle = ~(lower | upper)
         colorized = np.zeros((power.shape[0], power.shape[1], 3), 
                              dtype=np.uint8)
-        for color, region in enumerate([upper, middle, lower]):
-            new_channel = ifft2(np.where(region, power, 0.0))
-            shifted = (new_channel - new_channel.min())
-            scaled = 255.0*shifted/shifted.max()
-            colorized[..., color] = ifft2(np.where(region, power, 0.0))
+        # each region of the spectrum is not symmetric, so its inverse is 
+        # complex and needs the full transform, whose real part is cast to 
+        # the channel.  The three regions are inverted together as one 
+        # (3, H, W) stack.  The channels are not rescaled to 0-255. 
+        regions = np.array([upper, middle, lower])
+        channels = ifft2(np.where(regions, power, 0.0), axes=(1, 2))
+        colorized[...] = np.rollaxis(channels.real, 0, 3)
         return colorized
 
+# methods that batches can be run through
+pipeline_methods = ['invert', 'frequency_space_by_channel', 
+                    'colorize_by_power']
+
+# methods run on the worker process pool in concurrent mode
+pooled_methods = ['frequency_space_by_channel', 'colorize_by_power']
+
+def check_pipeline(pipeline):
+    for method in pipeline:
+        if method not in pipeline_methods:
+            raise Exception("Invalid pipeline method: {}".format(method))
+
+def apply_pipeline(methods, image, pipeline):
+    """ 
+    image run through the ImageMethods methods named in pipeline, in 
+    order, without transport or archiving
+    """
+    for method in pipeline:
+        image = getattr(methods, method).image_method(methods, image)
+    return image
+
+def init_worker():
+    """
+    Pool initializer.  Workers leave Control-C to the server, which shuts
+    them down, and leave archiving to the server process.
+    """
+    global worker_methods
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_methods = ImageMethods(archive='off')
+
+def call_image_method(method, params):
+    """ run an ImageMethods method in a pool worker process """
+    return getattr(worker_methods, method)(*params)
+
+def call_pipeline(args):
+    """ run a pipeline on one image of a batch in a pool worker process """
+    index, image, pipeline = args
+    return index, apply_pipeline(worker_methods, image, pipeline)
+
+
+class ServerStats(object):
+    """
+    Latency and throughput of each method, over the history most recent
+    calls for the latency percentiles
+    """
+    def __init__(self, history=10000):
+        self.history = history
+        self.latencies = {}
+        self.counts = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def record(self, method, seconds):
+        with self.lock:
+            if method not in self.latencies:
+                self.latencies[method] = deque(maxlen=self.history)
+                self.counts[method] = 0
+            self.latencies[method].append(seconds)
+            self.counts[method] += 1
+
+    def summary(self):
+        """ dict of method names to dicts of statistics """
+        elapsed = time.time() - self.started
+        with self.lock:
+            latencies = dict((method, np.array(times)) for method, times 
+                             in self.latencies.items())
+            counts = dict(self.counts)
+        summary = {}
+        for method, times in latencies.items():
+            p50, p99 = np.percentile(times, [50, 99])
+            # plain floats, as xmlrpclib cannot send numpy scalars
+            summary[method] = {'count': counts[method], 
+                               'per_sec': counts[method]/elapsed,
+                               'mean_sec': float(times.mean()), 
+                               'p50_sec': float(p50), 'p99_sec': float(p99), 
+                               'max_sec': float(times.max())}
+        return summary
+
+    def report(self):
+        lines = ["{:<28}{:>8}{:>10}{:>10}{:>10}{:>10}".format("method", 
+                 "count", "per sec", "mean (s)", "p50 (s)", "p99 (s)")]
+        for method, stats in sorted(self.summary().items()):
+            lines.append("{:<28}{count:>8}{per_sec:>10.2f}{mean_sec:>10.4f}"
+                         "{p50_sec:>10.4f}{p99_sec:>10.4f}".format(method, 
+                                                                   **stats))
+        return "\n".join(lines)
+
+
+class PooledImageMethods(object):
+    """
+    Dispatches XML-RPC calls to ImageMethods, running the FFT-heavy
+    methods in pooled_methods on a pool of worker processes so that they
+    neither hold the GIL nor block other requests.  Each call's latency is
+    recorded in stats, which clients can fetch with the stats method.
+    The images of pooled calls are archived by this process's methods.
+    The images of batches are spread over the pool, and returned in the
+    order they finish.
+    """
+    def __init__(self, workers, stats, **method_args):
+        # fork the workers before the archive starts its writer thread
+        self.pool = Pool(workers, initializer=init_worker)
+        self.methods = ImageMethods(map_pipeline=self.map_pipeline, 
+                                    **method_args)
+        self.stats = stats
+
+    def map_pipeline(self, images, pipeline):
+        """ (index, new image) pairs of pooled pipeline runs, as they finish """
+        return self.pool.imap_unordered(call_pipeline, 
+                                        [(index, image, pipeline) for 
+                                         index, image in enumerate(images)])
+
+    def _dispatch(self, method, params):
+        if method == 'stats':
+            return self.stats.summary()
+        if method.startswith('_') or not hasattr(self.methods, method):
+            raise Exception('method "{}" is not supported'.format(method))
+        start = time.time()
+        if method in pooled_methods:
+            result = self.pool.apply(call_image_method, (method, params))
+            self.methods.archive.record(params[0], result)
+        else:
+            result = getattr(self.methods, method)(*params)
+        self.stats.record(method, time.time() - start)
+        return result
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self.methods.archive.close()
+
+
+class QueuedXMLRPCServer(SimpleXMLRPCServer):
+    """
+    XML-RPC server that handles requests on a fixed number of threads, 
+    taking them from a queue of at most queue_size requests.  When the
+    queue is full the server stops accepting connections until there is
+    room, which pushes back on clients through the listen backlog.  The
+    backlog is also queue_size, rather than the default of 5, so that 
+    clients with many requests in flight are not refused connections.
+    """
+    def __init__(self, address, threads=8, queue_size=64, **kwargs):
+        self.request_queue_size = queue_size
+        SimpleXMLRPCServer.__init__(self, address, **kwargs)
+        self.requests = Queue.Queue(queue_size)
+        self.threads = [threading.Thread(target=self.serve_queue) 
+                        for n in range(threads)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def process_request(self, request, client_address):
+        self.requests.put((request, client_address))
+
+    def serve_queue(self):
+        while True:
+            queued = self.requests.get()
+            if queued is None:
+                break
+            request, client_address = queued
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def drain(self):
+        """ finish all queued requests, then stop the handler threads """
+        for thread in self.threads:
+            self.requests.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
 class ImageServer(object):
-    def __init__(self, name='localhost', port=5000, help=True):
+    """
+    Serves ImageMethods over XML-RPC.  With workers = 0, requests are 
+    handled one at a time.  Otherwise requests are handled concurrently on
+    threads threads, from a queue of at most queue_size requests, and the 
+    FFT methods run on a pool of workers processes.  On Control-C or 
+    SIGTERM the concurrent server stops accepting requests, finishes those
+    already queued, and prints per-method statistics.  Request images are
+    archived according to archive and sample_every, see ImageArchive.
+    """
+    def __init__(self, name='localhost', port=5000, help=True, workers=0, 
+                 threads=8, queue_size=64, archive='on', sample_every=10):
         self.name = name
         self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.queue_size = queue_size
+        self.method_args = {'archive': archive, 'sample_every': sample_every}
 
     def run(self):
+        if self.workers > 0:
+            return self.run_concurrent()
         server = SimpleXMLRPCServer((self.name, self.port))
-        server.register_instance(ImageMethods())
+        methods = ImageMethods(**self.method_args)
+        server.register_instance(methods)
         server.register_introspection_functions()
         print "Starting ImageServer........"
         print "Press Control-C to exit"
@@ -112,8 +607,64 @@ class ImageServer(object):
             server.serve_forever()
         except KeyboardInterrupt:
             print "\nImageServer exiting........."
+        finally:
+            methods.archive.close()
+
+    def run_concurrent(self):
+        stats = ServerStats()
+        # start the worker processes before any threads
+        methods = PooledImageMethods(self.workers, stats, **self.method_args)
+        server = QueuedXMLRPCServer((self.name, self.port), 
+                                    threads=self.threads, 
+                                    queue_size=self.queue_size, 
+                                    logRequests=False)
+        server.register_instance(methods)
+        server.register_introspection_functions()
+        signal.signal(signal.SIGTERM, stop_server)
+        print ("Starting ImageServer with {} worker processes and {} "
+               "threads........".format(self.workers, self.threads))
+        print "Press Control-C to exit"
+        try:
+            server.serve_forever()
+        except (KeyboardInterrupt, SystemExit):
+            print "\nImageServer finishing queued requests........."
+        finally:
+            server.server_close()
+            server.drain()
+            methods.close()
+            print stats.report()
+            print "archived {} requests, dropped {}, failed {}".format(
+                methods.methods.archive.written, 
+                methods.methods.archive.dropped, 
+                methods.methods.archive.failed)
+            print "ImageServer exiting........."
+
+def stop_server(signum, frame):
+    raise SystemExit()
 
             
 if __name__ == '__main__':
-    im_server = ImageServer(port=5009)
+    parser = argparse.ArgumentParser(description="Serve image methods "
+                                     "over XML-RPC")
+    parser.add_argument("--port", type=int, default=5009)
+    parser.add_argument("--workers", type=int, default=0, 
+                        help="worker processes for the FFT methods, 0 "
+                        "serves one request at a time")
+    parser.add_argument("--threads", type=int, default=8, 
+                        help="request handler threads in concurrent mode")
+    parser.add_argument("--queue-size", type=int, default=64, 
+                        dest="queue_size", help="most requests waiting in "
+                        "concurrent mode")
+    parser.add_argument("--archive", type=str, default="on", 
+                        choices=["on", "sampled", "off"], 
+                        help="which requests' images to save to "
+                        "server-images")
+    parser.add_argument("--sample-every", type=int, default=10, 
+                        dest="sample_every", help="archive one of this many "
+                        "requests with --archive sampled")
+    args = parser.parse_args()
+    im_server = ImageServer(port=args.port, workers=args.workers, 
+                            threads=args.threads, queue_size=args.queue_size,
+                            archive=args.archive, 
+                            sample_every=args.sample_every)
     im_server.run()
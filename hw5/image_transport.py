@@ -0,0 +1,35 @@
+"""
+Binary encoding of numpy image arrays for XML-RPC.  An image is sent as a
+struct holding its dtype, its shape and its raw bytes as an XML-RPC binary,
+rather than as nested lists of numbers, each of which becomes its own XML
+element.  The receiver wraps the bytes in an array with np.frombuffer,
+without copying them.
+"""
+
+import xmlrpclib
+
+import numpy as np
+
+
+def encode_image(image):
+    """ XML-RPC struct holding the array image as raw bytes """
+    image = np.ascontiguousarray(image)
+    return {'dtype': image.dtype.str, 'shape': list(image.shape),
+            'data': xmlrpclib.Binary(image.tostring())}
+
+def is_encoded(image):
+    return isinstance(image, dict) and 'data' in image
+
+def decode_image(image):
+    """
+    Array from a struct made by encode_image, which shares the memory of
+    the received bytes and so is read-only.  Images sent as nested lists
+    are also accepted, and converted to arrays.
+    """
+    if not is_encoded(image):
+        return np.array(image)
+    data = image['data']
+    if isinstance(data, xmlrpclib.Binary):
+        data = data.data
+    array = np.frombuffer(data, dtype=np.dtype(str(image['dtype'])))
+    return array.reshape(image['shape'])
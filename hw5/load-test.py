@@ -0,0 +1,74 @@
+"""
+Load test an ImageServer with many parallel connections.  Each connection
+sends requests of one image method, one after another, and the latency
+percentiles and total throughput are reported, followed by the server's
+own per-method statistics when it runs in concurrent mode.
+"""
+
+import time
+import argparse
+import threading
+import xmlrpclib
+
+import numpy as np
+
+from image_transport import encode_image, decode_image
+
+def run_connection(url, method, image, requests, latencies, errors):
+    """ send requests calls of method, appending each latency """
+    server = xmlrpclib.ServerProxy(url)
+    for request in range(requests):
+        start = time.time()
+        try:
+            decode_image(getattr(server, method)(image))
+        except Exception as error:
+            errors.append(error)
+            continue
+        latencies.append(time.time() - start)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test an ImageServer")
+    parser.add_argument("--host", type=str, default="localhost")
+    parser.add_argument("--port", type=int, default=5009)
+    parser.add_argument("--connections", type=int, default=8,
+                        help="number of parallel connections")
+    parser.add_argument("--requests", type=int, default=10,
+                        help="requests sent by each connection")
+    parser.add_argument("--method", type=str,
+                        default="frequency_space_by_channel")
+    parser.add_argument("--size", type=int, default=256,
+                        help="side length of the square rgb test image")
+    args = parser.parse_args()
+    url = "http://{}:{}".format(args.host, args.port)
+    image = encode_image(np.random.randint(0, 256, (args.size, args.size, 3)
+                                           ).astype(np.uint8))
+    latencies, errors = [], []
+    connections = [threading.Thread(target=run_connection,
+                                    args=(url, args.method, image,
+                                          args.requests, latencies, errors))
+                   for connection in range(args.connections)]
+    start = time.time()
+    for connection in connections:
+        connection.start()
+    for connection in connections:
+        connection.join()
+    elapsed = time.time() - start
+    print "{} connections x {} requests of {} on {}x{} images".format(
+        args.connections, args.requests, args.method, args.size, args.size)
+    print "completed {}, failed {}, in {:.2f} sec: {:.2f} requests/sec".format(
+        len(latencies), len(errors), elapsed, len(latencies)/elapsed)
+    if latencies:
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        print "latency p50 {:.4f} sec, p90 {:.4f} sec, p99 {:.4f} sec".format(
+            p50, p90, p99)
+    if errors:
+        print "first error: {}".format(errors[0])
+    try:
+        stats = xmlrpclib.ServerProxy(url).stats()
+    except xmlrpclib.Fault:
+        stats = None
+    if stats:
+        print "\nserver statistics:"
+        for method, method_stats in sorted(stats.items()):
+            print ("{}: {count} calls, {per_sec:.2f}/sec, mean {mean_sec:.4f} "
+                   "sec, p99 {p99_sec:.4f} sec".format(method, **method_stats))
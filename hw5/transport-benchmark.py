@@ -0,0 +1,83 @@
+"""
+Benchmark the round trip latency of ImageServer requests against image
+size, sending images as nested lists and binary encoded by image_transport.
+The server is run on a thread of this process, from a temporary directory
+so that the images it records are discarded.
+"""
+
+import os
+import imp
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import xmlrpclib
+from SimpleXMLRPCServer import SimpleXMLRPCServer
+
+import numpy as np
+
+from image_transport import encode_image, decode_image
+
+server_module = imp.load_source("image_server", os.path.join(
+                    os.path.dirname(os.path.abspath(__file__)),
+                    "image-server.py"))
+
+encodings = {'list': (lambda image: image.tolist(), np.array),
+             'binary': (encode_image, decode_image)}
+
+def start_server():
+    """ serve ImageMethods on a free port on a daemon thread """
+    server = SimpleXMLRPCServer(("localhost", 0), logRequests=False,
+                                allow_none=True)
+    server.register_instance(server_module.ImageMethods())
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def time_requests(proxy, method, image, encoding, trials):
+    """ best round trip time over trials, including encoding and decoding """
+    encode, decode = encodings[encoding]
+    times = []
+    for trial in range(trials):
+        start = time.time()
+        result = decode(getattr(proxy, method)(encode(image)))
+        times.append(time.time() - start)
+    return min(times), result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark list and "
+                                     "binary image transport")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[64, 128, 256, 512],
+                        help="side lengths of the square rgb test images")
+    parser.add_argument("--method", type=str, default="invert",
+                        choices=["invert", "frequency_space_by_channel",
+                                 "colorize_by_power"])
+    parser.add_argument("--trials", type=int, default=3,
+                        help="timing trials, the best is shown")
+    args = parser.parse_args()
+    work_dir = tempfile.mkdtemp()
+    os.mkdir(os.path.join(work_dir, "server-images"))
+    os.chdir(work_dir)
+    try:
+        server = start_server()
+        proxy = xmlrpclib.ServerProxy("http://localhost:{}".format(
+                                      server.server_address[1]))
+        print "{:>12}{:>12}{:>14}{:>14}{:>10}".format("size", "megapixels",
+            "list (sec)", "binary (sec)", "speedup")
+        for size in args.sizes:
+            image = np.random.randint(0, 256, (size, size, 3)).astype(np.uint8)
+            list_time, list_result = time_requests(proxy, args.method, image,
+                                                   'list', args.trials)
+            binary_time, binary_result = time_requests(proxy, args.method,
+                                                       image, 'binary',
+                                                       args.trials)
+            assert np.allclose(list_result, binary_result)
+            print "{:>12}{:>12.3f}{:>14.4f}{:>14.4f}{:>10.1f}".format(
+                "{0}x{0}".format(size), size**2/1e6, list_time, binary_time,
+                list_time/binary_time)
+        server.shutdown()
+    finally:
+        shutil.rmtree(work_dir)
@@ -4,100 +4,398 @@
 # Ryan Janish
 
 from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
 from time import time
+from math import erf, sqrt
+from collections import deque
 
 import numpy as np
-from numpy.random import random
+from numpy.random import random, RandomState
 
-def count_hits_loop(n):
+def count_hits_loop(n, rng=None):
 	''' 
 	Simulate n dart throws into the first quadrant of [-1,1]x[-1,1] 
 	and count the number of throws inside the unit circle. 
-	Implemented with a pure python loop.
+	Implemented with a pure python loop. Random numbers are drawn from 
+	the numpy RandomState rng, or the global numpy generator if None.
 	'''
+	draw = random if rng is None else rng.random_sample
 	hits = 0
 	for throw in xrange(int(n)):
-		x, y = random(), random()
+		x, y = draw(), draw()
 		if x**2 + y**2 <= 1.0:	  
 			hits += 1
 	return hits			  
 
-def count_hits_numpy(n):
+def sample_random(start, size, rng=None):
+	''' size pseudo-random points, drawn from rng or the global generator '''
+	draw = random if rng is None else rng.random_sample
+	return draw(size), draw(size)
+
+def sample_antithetic(start, size, rng=None):
+	'''
+	size pseudo-random points in antithetic pairs (x, y) and (1-x, 1-y), 
+	with one unpaired point if size is odd
+	'''
+	draw = random if rng is None else rng.random_sample
+	half = size//2
+	x, y = draw(half + size % 2), draw(half + size % 2)
+	return (np.concatenate([x, 1.0 - x[:half]]), 
+			np.concatenate([y, 1.0 - y[:half]]))
+
+def sample_stratified(start, size, rng=None):
+	'''
+	size points jittered on a k by k grid of strata, one point in each, 
+	where k is the largest integer with k**2 <= size.  The remaining 
+	points are pseudo-random. 
+	'''
+	draw = random if rng is None else rng.random_sample
+	k = int(np.sqrt(size))
+	while k**2 > size:
+		k -= 1
+	cells = np.arange(k**2)
+	x = np.concatenate([(cells % k + draw(k**2))/float(k), 
+						draw(size - k**2)])
+	y = np.concatenate([(cells // k + draw(k**2))/float(k), 
+						draw(size - k**2)])
+	return x, y
+
+def radical_inverse(index, base):
+	''' van der Corput radical inverse of each integer in index '''
+	index = index.copy()
+	result = np.zeros(index.shape)
+	scale = 1.0/base
+	while index.any():
+		quotient = index//base
+		result += scale*(index - base*quotient)
+		index = quotient
+		scale /= base
+	return result
+
+def sample_halton(start, size, rng=None):
+	''' points start to start + size of the 2d Halton sequence '''
+	index = np.arange(start + 1, start + size + 1, dtype=np.int64)
+	return radical_inverse(index, 2), radical_inverse(index, 3)
+
+# direction numbers of the first two dimensions of the Sobol sequence, 
+# with 52 bits of precision.  The first dimension is the van der Corput
+# sequence, the second uses the primitive polynomial x + 1. 
+sobol_bits = 52
+sobol_directions = [[1 << (sobol_bits - 1 - bit) for bit in range(sobol_bits)],
+					[1 << (sobol_bits - 1)]]
+for bit in range(1, sobol_bits):
+	previous = sobol_directions[1][-1]
+	sobol_directions[1].append(previous ^ (previous >> 1))
+sobol_directions = np.array(sobol_directions, dtype=np.uint64)
+
+def sample_sobol(start, size, rng=None):
+	''' points start to start + size of the 2d Sobol sequence '''
+	index = np.arange(start + 1, start + size + 1, dtype=np.uint64)
+	x = np.zeros(size, dtype=np.uint64)
+	y = np.zeros(size, dtype=np.uint64)
+	bit = 0
+	while index.any():
+		has_bit = index & np.uint64(1)
+		x ^= has_bit*sobol_directions[0, bit]
+		y ^= has_bit*sobol_directions[1, bit]
+		index >>= np.uint64(1)
+		bit += 1
+	return x/float(2**sobol_bits), y/float(2**sobol_bits)
+
+samplers = {'random':sample_random, 'antithetic':sample_antithetic, 
+			'stratified':sample_stratified, 'halton':sample_halton, 
+			'sobol':sample_sobol}
+
+def count_hits_numpy(n, rng=None, block_size=2**16, sampler='random', 
+					 start=0):
 	''' 
 	Simulate n dart throws into the first quadrant of [-1,1]x[-1,1] 
 	and count the number of throws inside the unit circle. 
-	Implemented with a numpy vectorized array
+	Implemented with numpy vectorized arrays, processing the darts in 
+	blocks of block_size so that memory use does not grow with n. Darts 
+	are placed by the named sampler, one of the keys of samplers:  
+	'random' draws from the numpy RandomState rng, or the global numpy 
+	generator if None, 'antithetic' and 'stratified' are variance reduced
+	versions of 'random', and 'halton' and 'sobol' are low-discrepancy 
+	sequences, of which points start to start + n are used.  
 	'''
-	rsq = random(n)**2 + random(n)**2
-	hits = np.sum(rsq <= 1)
+	sample = samplers[sampler]
+	n = int(n)
+	inside = np.empty(min(block_size, n), dtype=bool)
+	hits = 0
+	for offset in xrange(0, n, block_size):
+		size = min(block_size, n - offset)
+		x, y = sample(start + offset, size, rng)
+		# x**2 + y**2, computed in place
+		np.multiply(x, x, out=x)
+		np.multiply(y, y, out=y)
+		np.add(x, y, out=x)
+		np.less_equal(x, 1.0, out=inside[:size])
+		hits += np.count_nonzero(inside[:size])
 	return hits		
 
-def compute_pi_serial(n, style='numpy'):
+def compute_pi_serial(n, style='numpy', sampler='random'):
 	'''
 	Approximate pi using a monte-carlo dartboard, implemented using	
 	either 	python loops or numpy, depending on the value of 'style'.  
-	n is the number of darts simulated. Execution is timed. 
+	n is the number of darts simulated. With numpy, darts are placed by 
+	the named sampler, see count_hits_numpy. Execution is timed. 
 	'''
+	start = time()
 	if style == 'numpy':
-		counter = count_hits_numpy
+		hits = count_hits_numpy(n, sampler=sampler)
 	else:
-		counter = count_hits_loop
-	start = time()
-	hits = counter(n)
+		hits = count_hits_loop(n)
 	exec_time = time() - start
 	return 4*hits/float(n), exec_time
 
-def compute_pi_multiprocessing(n, cores=None, style='numpy'):
+def normal_quantile(confidence):
 	'''
-	Approximate pi using a monte-carlo dartboard, implemented using
-	pure python loops parallelized over the passed number of cores. 
-	Parallelization is done using the multiprocessing module. If 
-	cores=None then the default number of cores detected by multiprocessing
-	will be used. n is the number of darts simulated. Execution is timed. 
+	Return z such that a standard normal variable lies within [-z, z] 
+	with probability confidence, found by bisection
 	'''
-	if cores is None:
-		cores = cpu_count()
-	else:
-		cores = int(cores)
+	low, high = 0.0, 40.0
+	for step in range(100):
+		z = 0.5*(low + high)
+		if erf(z/sqrt(2.0)) < confidence:
+			low = z
+		else:
+			high = z
+	return high
+
+def relative_error(hits, n, confidence=0.95):
+	'''
+	Half-width of the confidence interval of the pi estimate 4*hits/n, 
+	relative to the estimate, using the binomial standard error of the 
+	fraction of hits.  Infinite if the error cannot yet be estimated.
+	'''
+	if hits <= 0 or hits >= n:
+		return np.inf
+	frac = hits/float(n)
+	std_error = sqrt(frac*(1.0 - frac)/n)
+	return normal_quantile(confidence)*std_error/frac
+
+def count_hits_task(task):
+	'''
+	Worker function for PiEstimator.  task is a tuple (n, seed, style, 
+	sampler, start), and n darts are counted with a RandomState seeded with
+	seed, so that each task draws from its own independent stream.  The 
+	low-discrepancy samplers instead use points start to start + n of 
+	their sequence, so that tasks cover disjoint segments.
+	'''
+	n, seed, style, sampler, start = task
 	if style == 'numpy':
-		counter = count_hits_numpy
+		hits = count_hits_numpy(n, rng=RandomState(seed), sampler=sampler, 
+								start=start)
 	else:
-		counter = count_hits_loop
-	start = time()
-	workers = Pool(cores)
-	hits_parallel = workers.map(counter, [n/cores]*cores)
-	hits = sum(hits_parallel)
-	exec_time = time() - start
-	return 4*hits/float(n), exec_time
+		hits = count_hits_loop(n, rng=RandomState(seed))
+	return int(hits)
 
-if __name__ == '__main__':
-	# run each serial/parallel method with both loops and numpy 
-	# for 10 log-spaced samples between 10 and 10**8
-	calculators = {'serial':compute_pi_serial, 
-				   'multiprocessing':compute_pi_multiprocessing}
-	results = {'Error':{}, 'Execution Time':{}, 'Simulation Rate':{}}
-	dart_number = np.int64(np.logspace(1, 8, num=10))
-	for style in ['loop', 'numpy']:
-		for calc_type in calculators:
-			label = "{}-{}".format(calc_type, style)
-			for result in results:
-				results[result][label] = []
-			for n in dart_number:
-				pi_approx, t = calculators[calc_type](n, style=style)
-				frac_error = np.absolute(np.pi-pi_approx)/np.pi
-				results["Error"][label].append(frac_error)
-				results["Execution Time"][label].append(t)
-				results["Simulation Rate"][label].append(n/t)
-	# plot results			
-	from matplotlib import pyplot as plt
-	fig, axs = plt.subplots(3, 1)
-	for ax, parameter in zip(axs, results.keys()):
-		for run in results[parameter]:
-			ax.loglog(dart_number, results[parameter][run], label=run)
-			ax.set_title(parameter, fontsize=12)
-	plt.legend(fontsize=10, loc='lower left')
-	plt.suptitle("Monte Carlo Comparison - Linux Laptop, "
-				 "4-Core 2.8 GHz Intel i7", fontsize=14)
-	plt.show()
+class PiEstimator(object):
+	'''
+	Monte-carlo dartboard estimator of pi that owns a persistent pool of
+	workers, so that the pool is started once and reused by every 
+	estimate.  With backend='processes' the workers are processes, and 
+	with backend='threads' they are threads in this process, which run 
+	in parallel only while numpy has released the GIL.  The n darts of an 
+	estimate are split exactly into tasks of at most chunk_size darts, 
+	each task is seeded with its own stream (seed, estimate number, task 
+	number), and the hit counts of the tasks are summed as they complete.
+	If cores=None then the default number of cores detected by 
+	multiprocessing will be used, and if seed=None a random seed is 
+	chosen.  With the numpy style, darts are placed by the named sampler 
+	(see count_hits_numpy), and tasks of the low-discrepancy samplers take
+	consecutive segments of the sequence.
+	Use close() or a with statement to shut down the pool.
+	'''
+	def __init__(self, cores=None, chunk_size=10**6, style='numpy', seed=None,
+				 backend='processes', sampler='random'):
+		if cores is None:
+			cores = cpu_count()
+		self.cores = int(cores)
+		self.chunk_size = int(chunk_size)
+		self.style = style
+		self.sampler = sampler
+		if seed is None:
+			seed = RandomState().randint(2**31)
+		self.seed = seed
+		self.estimates = 0
+		self.backend = backend
+		if backend == 'threads':
+			self.pool = ThreadPool(self.cores)
+		else:
+			self.pool = Pool(self.cores)
+
+	def next_stream(self):
+		''' return a new estimate number, used to seed its tasks '''
+		self.estimates += 1
+		return self.estimates - 1
+
+	def tasks(self, n, stream):
+		''' generate the tasks for n darts, summing exactly to n '''
+		n = int(n)
+		full_chunks, remainder = divmod(n, self.chunk_size)
+		sizes = [self.chunk_size]*full_chunks
+		if remainder:
+			sizes.append(remainder)
+		start = 0
+		for index, size in enumerate(sizes):
+			yield (size, [self.seed, stream, index], self.style, self.sampler,
+				   start)
+			start += size
+
+	def count_hits(self, n):
+		''' throw n darts over the pool and return the total hits '''
+		tasks = self.tasks(n, self.next_stream())
+		return sum(self.pool.imap_unordered(count_hits_task, tasks))
+
+	def estimate(self, n):
+		''' 
+		Approximate pi with n darts. Returns the approximation and the 
+		execution time, which does not include starting the pool. 
+		'''
+		start = time()
+		hits = self.count_hits(n)
+		exec_time = time() - start
+		return 4*hits/float(n), exec_time
+
+	def estimate_to_precision(self, target_error, confidence=0.95, 
+							  max_darts=None):
+		'''
+		Approximate pi, throwing darts until the relative error of the 
+		estimate at the given confidence level is below target_error, or 
+		until max_darts darts have been thrown.  Tasks of chunk_size darts
+		are kept queued on the pool, 2 per core, and the running error is
+		updated as each one finishes.  Once the target is met no new tasks
+		are started and those still running are added to the estimate. 
+		Returns a tuple (pi_approx, n, exec_time, error), with n the 
+		number of darts used and error the achieved relative error. The 
+		error assumes independent darts, so it is conservative for the 
+		variance reduced and low-discrepancy samplers.  max_darts must be
+		positive if given, and is required if target_error is not 
+		positive, otherwise a ValueError is raised.
+		'''
+		if max_darts is not None and int(max_darts) <= 0:
+			raise ValueError("max_darts must be positive, got {}".format(
+							 max_darts))
+		if target_error <= 0 and max_darts is None:
+			raise ValueError("target_error must be positive unless max_darts "
+							 "is given, got {}".format(target_error))
+		start = time()
+		stream = self.next_stream()
+		running = deque()
+		hits, darts, submitted, task_index = 0, 0, 0, 0
+		error = np.inf
+		while True:
+			while (error > target_error and len(running) < 2*self.cores and
+				   (max_darts is None or submitted < max_darts)):
+				size = self.chunk_size
+				if max_darts is not None:
+					size = min(size, int(max_darts) - submitted)
+				task = (size, [self.seed, stream, task_index], self.style, 
+						self.sampler, submitted)
+				running.append((size, self.pool.apply_async(count_hits_task, 
+															 (task,))))
+				submitted += size
+				task_index += 1
+			if not running:
+				break
+			size, result = running.popleft()
+			hits += result.get()
+			darts += size
+			error = relative_error(hits, darts, confidence)
+		exec_time = time() - start
+		return 4*hits/float(darts), darts, exec_time, error
+
+	def estimate_async(self, n, callback=None):
+		'''
+		Start approximating pi with n darts and return immediately with an 
+		AsyncEstimate, whose get() method waits for and returns the 
+		approximation and execution time.  If given, callback is called 
+		with the approximation and execution time once they are ready, 
+		from a helper thread of the pool.
+		'''
+		pending = AsyncEstimate(n, callback)
+		tasks = list(self.tasks(n, self.next_stream()))
+		pending.result = self.pool.map_async(count_hits_task, tasks, 
+											 callback=pending.finish)
+		return pending
+
+	def close(self):
+		self.pool.close()
+		self.pool.join()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.close()
+
+class AsyncEstimate(object):
+	''' A pi estimate in progress, returned by PiEstimator.estimate_async '''
+	def __init__(self, n, callback=None):
+		self.n = n
+		self.callback = callback
+		self.start = time()
 
+	def finish(self, hits):
+		self.pi_approx = 4*sum(hits)/float(self.n)
+		self.exec_time = time() - self.start
+		if self.callback is not None:
+			self.callback(self.pi_approx, self.exec_time)
 
+	def ready(self):
+		return self.result.ready()
+
+	def wait(self, timeout=None):
+		self.result.wait(timeout)
+
+	def get(self, timeout=None):
+		self.result.get(timeout)
+		return self.pi_approx, self.exec_time
+
+def compute_pi_multiprocessing(n, cores=None, style='numpy', estimator=None,
+							   sampler='random'):
+	'''
+	Approximate pi using a monte-carlo dartboard, implemented using
+	either python loops or numpy parallelized over the passed number of 
+	cores. Parallelization is done using the multiprocessing module, via
+	the passed PiEstimator, or a temporary one if estimator=None. If 
+	cores=None then the default number of cores detected by multiprocessing
+	will be used. n is the number of darts simulated. Execution is timed, 
+	excluding the start up of the worker pool. 
+	'''
+	if estimator is not None:
+		return estimator.estimate(n)
+	with PiEstimator(cores=cores, style=style, sampler=sampler) as estimator:
+		return estimator.estimate(n)
+
+def compute_pi_threads(n, cores=None, style='numpy', estimator=None,
+					   sampler='random'):
+	'''
+	Approximate pi using a monte-carlo dartboard, implemented using
+	either python loops or numpy parallelized over the passed number of 
+	threads, via the passed threaded PiEstimator, or a temporary one if 
+	estimator=None. If cores=None then the number of cores detected by 
+	multiprocessing will be used. n is the number of darts simulated. 
+	Execution is timed, excluding the start up of the thread pool. 
+	'''
+	if estimator is not None:
+		return estimator.estimate(n)
+	with PiEstimator(cores=cores, style=style, backend='threads', 
+					 sampler=sampler) as estimator:
+		return estimator.estimate(n)
+
+if __name__ == '__main__':
+	# run each serial/parallel method with both loops and numpy for 10 
+	# log-spaced samples between 10 and 10**8, saving the plot and results
+	# to OUTPUT.pdf and OUTPUT.json, see pi_benchmark.py for other sweeps 
+	# and options.  usage: parallel_pi.py [OUTPUT]
+	import sys
+	import pi_benchmark
+	output = sys.argv[1] if len(sys.argv) > 1 else 'monte-carlo-rerun'
+	dart_number = ['{:d}'.format(n) for n in 
+				   np.int64(np.logspace(1, 8, num=10))]
+	pi_benchmark.main(['--n'] + dart_number + ['--styles', 'loop', 'numpy',
+					   '--trials', '3', '--json', output + '.json',
+					   '--plot', output + '.pdf'])
@@ -0,0 +1,280 @@
+'''benchmark runner for the serial and parallel pi estimators'''
+
+# homework 8, python seminar fall 2013
+# Ryan Janish
+
+import argparse
+import csv
+import json
+import platform
+import sys
+from datetime import datetime
+from multiprocessing import cpu_count
+from time import time
+
+import numpy as np
+
+from parallel_pi import compute_pi_serial, PiEstimator, samplers
+
+backends = {'multiprocessing':'processes', 'threads':'threads'}
+fields = ['method', 'style', 'sampler', 'n', 'cores', 'chunk_size',
+		  'trials', 'median_time', 'iqr_time', 'median_rate', 'median_error',
+		  'peak_rss_mb']
+
+def cpu_name():
+	''' best available description of this machine's cpu '''
+	try:
+		with open('/proc/cpuinfo') as cpuinfo:
+			for line in cpuinfo:
+				if line.startswith('model name'):
+					return line.split(':', 1)[1].strip()
+	except IOError:
+		pass
+	return platform.processor() or platform.machine()
+
+def machine_info():
+	return {'cpu':cpu_name(), 'cores':cpu_count(),
+			'platform':platform.platform(),
+			'python':platform.python_version(), 'numpy':np.__version__,
+			'date':datetime.now().isoformat()}
+
+def worker_pids(estimator):
+	''' process ids of the worker processes of a PiEstimator, if any '''
+	if estimator is None or estimator.backend == 'threads':
+		return []
+	return [worker.pid for worker in estimator.pool._pool]
+
+def reset_peak_rss(pids):
+	'''
+	Reset the peak resident memory of this process and of the processes
+	pids to their current resident memory, so that peak_rss_mb measures
+	only what runs after.  Returns False where this is not supported, 
+	which needs /proc/PID/clear_refs from linux 4.0.
+	'''
+	try:
+		for pid in ['self'] + pids:
+			with open('/proc/{}/clear_refs'.format(pid), 'w') as clear_refs:
+				clear_refs.write('5')
+	except IOError:
+		return False
+	return True
+
+def peak_rss_mb(pids):
+	'''
+	Sum of the peak resident memory, in MiB, of this process and of the
+	processes pids since reset_peak_rss, from VmHWM in /proc/PID/status
+	'''
+	total = 0
+	for pid in ['self'] + pids:
+		with open('/proc/{}/status'.format(pid)) as status:
+			for line in status:
+				if line.startswith('VmHWM:'):
+					total += int(line.split()[1])
+	return total/1024.0
+
+def time_trials(run, n, trials, warmup):
+	'''
+	Call run(n), which returns (pi_approx, exec_time), warmup times
+	without recording and then trials times.  Returns the execution
+	times and fractional errors of the recorded trials.
+	'''
+	for trial in range(warmup):
+		run(n)
+	times, errors = [], []
+	for trial in range(trials):
+		pi_approx, exec_time = run(n)
+		times.append(exec_time)
+		errors.append(abs(np.pi - pi_approx)/np.pi)
+	return np.array(times), np.array(errors)
+
+def summarize(method, style, sampler, n, cores, chunk_size, times, errors,
+			  peak_rss):
+	q1, median, q3 = np.percentile(times, [25, 50, 75])
+	return {'method':method, 'style':style, 'sampler':sampler, 'n':int(n),
+			'cores':cores, 'chunk_size':chunk_size, 'trials':len(times),
+			'median_time':median, 'iqr_time':q3 - q1,
+			'median_rate':n/max(median, 1e-12),
+			'median_error':float(np.median(errors)),
+			'peak_rss_mb':peak_rss}
+
+def run_benchmark(dart_numbers, methods, styles, core_counts, chunk_sizes,
+				  samplers=('random',), trials=5, warmup=1, verbose=True):
+	'''
+	Time every combination of method ('serial', 'multiprocessing' or
+	'threads'), style ('loop' or 'numpy'), sampler (numpy style only, see
+	parallel_pi.count_hits_numpy) and number of darts.  The parallel 
+	methods are also swept over core_counts and chunk_sizes, using one 
+	PiEstimator per combination that is reused for all dart numbers.  
+	The peak resident memory of each configuration, of this process and
+	the estimator's worker processes, is measured on its own, and is None
+	where the peak cannot be reset between configurations.
+	Returns a list of result dicts with the keys in fields.
+	'''
+	results = []
+	style_samplers = [(style, sampler) for style in styles
+					  for sampler in samplers
+					  if style == 'numpy' or sampler == 'random']
+	for style, sampler in style_samplers:
+		for method in methods:
+			if method in backends:
+				configs = [(cores, chunk_size) for cores in core_counts
+							for chunk_size in chunk_sizes]
+			else:
+				configs = [(1, None)]
+			for cores, chunk_size in configs:
+				if method in backends:
+					estimator = PiEstimator(cores=cores,
+											chunk_size=chunk_size, style=style,
+											backend=backends[method],
+											sampler=sampler)
+					run = estimator.estimate
+				else:
+					estimator = None
+					run = lambda n: compute_pi_serial(n, style=style,
+													  sampler=sampler)
+				pids = worker_pids(estimator)
+				for n in dart_numbers:
+					measured = reset_peak_rss(pids)
+					times, errors = time_trials(run, n, trials, warmup)
+					peak_rss = peak_rss_mb(pids) if measured else None
+					result = summarize(method, style, sampler, n, cores,
+									   chunk_size, times, errors, peak_rss)
+					results.append(result)
+					if verbose:
+						print ("{method}-{style}-{sampler} n={n} "
+							   "cores={cores} chunk={chunk_size}: "
+							   "{median_time:.4g} sec "
+							   "(IQR {iqr_time:.2g})".format(**result))
+				if estimator is not None:
+					estimator.close()
+	return results
+
+def config_key(result):
+	return (result['method'], result['style'],
+			result.get('sampler', 'random'), result['n'], result['cores'],
+			result['chunk_size'])
+
+def write_results(results, machine, json_file=None, csv_file=None):
+	if json_file is not None:
+		with open(json_file, 'w') as output:
+			json.dump({'machine':machine, 'results':results}, output,
+					  indent=1, sort_keys=True)
+	if csv_file is not None:
+		with open(csv_file, 'wb') as output:
+			writer = csv.DictWriter(output, fieldnames=fields)
+			writer.writeheader()
+			for result in results:
+				writer.writerow(result)
+
+def compare_to_baseline(results, baseline_file, tolerance=0.1):
+	'''
+	Print the ratio of each median time to the median time of the same
+	configuration in the json results file baseline_file.  Ratios more
+	than tolerance above 1, and also outside both runs' IQRs, are flagged
+	as slower.  Returns the number of slower configurations.
+	'''
+	with open(baseline_file) as baseline:
+		baseline = json.load(baseline)
+	print "\ncomparison to {} ({}):".format(baseline_file,
+											 baseline['machine']['cpu'])
+	old_results = dict((config_key(result), result)
+					   for result in baseline['results'])
+	slower = 0
+	for result in results:
+		old = old_results.get(config_key(result))
+		if old is None:
+			continue
+		ratio = result['median_time']/max(old['median_time'], 1e-12)
+		spread = result['iqr_time'] + old['iqr_time']
+		flag = ''
+		if (ratio > 1.0 + tolerance and
+			result['median_time'] - old['median_time'] > spread):
+			flag = '  SLOWER'
+			slower += 1
+		print "{}-{}-{} n={} cores={} chunk={}: {:.2f}x{}".format(
+			*(config_key(result) + (ratio, flag)))
+	return slower
+
+def plot_results(results, machine, plot_file):
+	'''
+	Plot error, execution time and simulation rate against number of
+	darts, and error against execution time, for each method, style and
+	sampler, one curve per configuration
+	'''
+	from matplotlib import pyplot as plt
+	curves = {}
+	for result in results:
+		label = "{}-{}".format(result['method'], result['style'])
+		if result['style'] == 'numpy':
+			label += "-{}".format(result['sampler'])
+		if result['method'] in backends:
+			label += " ({} cores, chunk {})".format(result['cores'],
+													  result['chunk_size'])
+		curves.setdefault(label, []).append(result)
+	panels = [('n', 'median_error', 'Error'),
+			  ('n', 'median_time', 'Execution Time'),
+			  ('n', 'median_rate', 'Simulation Rate'),
+			  ('median_time', 'median_error', 'Error vs Execution Time')]
+	fig, axs = plt.subplots(4, 1, figsize=(8, 16))
+	for ax, (x_key, y_key, title) in zip(axs, panels):
+		for label in sorted(curves):
+			curve = sorted(curves[label], key=lambda result: result['n'])
+			ax.loglog([result[x_key] for result in curve],
+					  [result[y_key] for result in curve], label=label)
+		ax.set_title(title, fontsize=12)
+	axs[-1].legend(fontsize=8, loc='lower right')
+	plt.suptitle("Monte Carlo Comparison - {}, {} cores".format(
+				 machine['cpu'], machine['cores']), fontsize=12)
+	plt.savefig(plot_file)
+	plt.close('all')
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmark the serial and "
+									 "parallel monte carlo pi estimators")
+	parser.add_argument('--n', type=float, nargs='+',
+						default=list(np.logspace(4, 7, num=4)),
+						help="numbers of darts to sweep")
+	parser.add_argument('--methods', nargs='+',
+						default=['serial', 'multiprocessing', 'threads'],
+						choices=['serial', 'multiprocessing', 'threads'])
+	parser.add_argument('--styles', nargs='+', default=['numpy'],
+						choices=['loop', 'numpy'])
+	parser.add_argument('--samplers', nargs='+', default=['random'],
+						choices=sorted(samplers), help="dart samplers to "
+						"sweep for the numpy style")
+	parser.add_argument('--cores', type=int, nargs='+',
+						default=[cpu_count()], help="core counts to sweep "
+						"for the parallel methods")
+	parser.add_argument('--chunk-size', type=float, nargs='+',
+						default=[10**6], dest='chunk_sizes',
+						help="task sizes to sweep for the parallel methods")
+	parser.add_argument('--trials', type=int, default=5,
+						help="timed trials per configuration")
+	parser.add_argument('--warmup', type=int, default=1,
+						help="untimed runs before the trials")
+	parser.add_argument('--json', type=str, default=None,
+						help="write results to this json file")
+	parser.add_argument('--csv', type=str, default=None,
+						help="write results to this csv file")
+	parser.add_argument('--baseline', type=str, default=None,
+						help="json results file to compare against")
+	parser.add_argument('--plot', type=str, default=None,
+						help="save a comparison plot to this file")
+	args = parser.parse_args(argv)
+	machine = machine_info()
+	print "{cpu}, {cores} cores, python {python}, numpy {numpy}".format(
+		**machine)
+	results = run_benchmark([int(n) for n in args.n], args.methods,
+							args.styles, args.cores,
+							[int(size) for size in args.chunk_sizes],
+							samplers=args.samplers, trials=args.trials,
+							warmup=args.warmup)
+	write_results(results, machine, json_file=args.json, csv_file=args.csv)
+	if args.plot is not None:
+		plot_results(results, machine, args.plot)
+	if args.baseline is not None:
+		return compare_to_baseline(results, args.baseline)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main() > 0)